@@ -0,0 +1,121 @@
+# This file is part of shipit, a curses-based, fedmsg-aware heads up display
+# for Fedora package maintainers.
+# Copyright (C) 2014  Ralph Bean <rbean@redhat.com>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import collections
+import urlparse
+
+
+# Hosts anitya has a backend for.  Subdomains count too, so
+# foo.sourceforge.net is Sourceforge.
+backends = {
+    'ftp.debian.org': 'Debian project',
+    'www.drupal.org': 'Drupal7',
+    'freecode.com': 'Freshmeat',
+    'github.com': 'GitHub',
+    'download.gnome.org': 'GNOME',
+    'ftp.gnu.org': 'GNU project',
+    'code.google.com': 'Google code',
+    'hackage.haskell.org': 'Hackage',
+    'launchpad.net': 'launchpad',
+    'www.npmjs.org': 'npmjs',
+    'packagist.org': 'Packagist',
+    'pear.php.net': 'PEAR',
+    'pecl.php.net': 'PECL',
+    'pypi.python.org': 'PyPI',
+    'rubygems.org': 'Rubygems',
+    'sourceforge.net': 'Sourceforge',
+}
+
+prefixes = [
+    'python-',
+    'php-',
+    'nodejs-',
+]
+
+easy_guesses = set([
+    'Debian project',
+    'Drupal7',
+    'Freshmeat',
+    'GitHub',
+    'GNOME',
+    'GNU project',
+    'Google code',
+    'Hackage',
+    'launchpad',
+    'npmjs',
+    'PEAR',
+    'PECL',
+    'PyPI',
+    'Rubygems',
+    'Sourceforge',
+])
+
+
+def _index(backends):
+    """ Hosts to backends, with and without a leading www. """
+    index = {}
+    for host, backend in backends.items():
+        index[host] = backend
+        if host.startswith('www.'):
+            index[host[len('www.'):]] = backend
+    return index
+
+hosts = _index(backends)
+
+
+Classification = collections.namedtuple(
+    'Classification', ['backend', 'name'])
+
+
+def backend_for(url):
+    """ The anitya backend serving url, or None. """
+    host = urlparse.urlparse(url).hostname
+    if not host and '://' not in url:
+        # pkgdb has some upstream urls without a scheme.
+        host = urlparse.urlparse('http://' + url).hostname
+    if not host:
+        return None
+
+    labels = host.lower().split('.')
+    for i in range(len(labels) - 1):
+        backend = hosts.get('.'.join(labels[i:]))
+        if backend:
+            return backend
+    return None
+
+
+def strip_prefix(name):
+    """ python-foo is usually called foo upstream. """
+    for prefix in prefixes:
+        if name.startswith(prefix):
+            return name[len(prefix):]
+    return name
+
+
+def classify(name, url):
+    """ Guess a package's anitya backend and upstream project name. """
+    url = url or ''
+    backend = backend_for(url)
+    if backend in easy_guesses:
+        # For these, we can get a pretty good guess at the upstream name.
+        guess = url.strip('/').split('/')[-1]
+    else:
+        guess = strip_prefix(name)
+    return Classification(backend, guess)
@@ -1,15 +1,38 @@
+import collections
 import os
 import random
 import string
+import threading
 import time
+import zlib
 
 import koji
+import twisted.internet.defer
+import twisted.internet.threads
+import twisted.python.threadpool
 
+import shipit.reactor
+import shipit.signals
 from shipit.log import log
 
 
-class Buildsys(object):
-    def __init__(self, config):
+def adler32(data):
+    """ Hex adler32 checksum, the way the koji hub reports it. """
+    return '%08x' % (zlib.adler32(data) & 0xffffffff)
+
+
+class Buildsys(shipit.signals.AsyncNotifier):
+    """ Asynchronous facade over koji.
+
+    Every koji call blocks, so they all run in a dedicated thread pool and
+    come back to the reactor as Deferreds.  Logged-in sessions are kept in a
+    pool and reused, logging in again if koji tells us the session expired.
+
+    Progress of SRPM uploads is signalled as 'upload' events with the package
+    name, the branch, the bytes uploaded so far and the total size.
+    """
+
+    def __init__(self, config, *args, **kwargs):
         self.config = config
 
         self.server = config['koji_server']
@@ -23,11 +46,78 @@ class Buildsys(object):
         self.priority = 30
         self.opts = {'scratch': True}
 
+        self.chunk_size = config['koji.upload_chunk']
+        self.upload_retries = config['koji.upload_retries']
+
+        self.pool = twisted.python.threadpool.ThreadPool(
+            maxthreads=config['koji.threads'], name='koji')
+        self.sessions = []
+        self.sessions_lock = threading.Lock()
+
+        # State for the task poller.
+        self.tasks = None
+        self.poll_min = config['koji.poll_min']
+        self.poll_max = config['koji.poll_max']
+        self.poll_interval = self.poll_min
+        self.outstanding = {}
+        # How long finished tasks took, so we can guess when others will end.
+        self.durations = collections.deque(maxlen=50)
+        # Where to record how long koji took with our tasks, if anywhere.
+        self.history = None
+
+        super(Buildsys, self).__init__(*args, **kwargs)
+
     def session_maker(self):
         koji_session = koji.ClientSession(self.server, {'timeout': 3600})
         koji_session.ssl_login(self.cert, self.ca_cert, self.ca_cert)
         return koji_session
 
+    def call(self, fn, *args, **kwargs):
+        """ Run fn(session, *args, **kwargs) in the koji thread pool.
+
+        Returns a Deferred that fires with the result.
+        """
+        if not self.pool.started:
+            self.pool.start()
+            shipit.reactor.reactor.addSystemEventTrigger(
+                'during', 'shutdown', self.pool.stop)
+        return twisted.internet.threads.deferToThreadPool(
+            shipit.reactor.reactor, self.pool,
+            self._with_session, fn, *args, **kwargs)
+
+    def _with_session(self, fn, *args, **kwargs):
+        """ Lend fn a logged-in session from the pool.  Runs in a thread. """
+        with self.sessions_lock:
+            session = self.sessions.pop() if self.sessions else None
+
+        if session is None:
+            session = self.session_maker()
+
+        try:
+            result = fn(session, *args, **kwargs)
+        except koji.AuthError:
+            # The old session is dropped.  A new one only joins the pool once
+            # it has worked; if logging in fails, we just raise.
+            session = self.session_maker()
+            try:
+                result = fn(session, *args, **kwargs)
+            except koji.AuthError:
+                raise
+            except Exception:
+                self._return_session(session)
+                raise
+        except Exception:
+            self._return_session(session)
+            raise
+
+        self._return_session(session)
+        return result
+
+    def _return_session(self, session):
+        session.multicall = False
+        with self.sessions_lock:
+            self.sessions.append(session)
+
     def url_for(self, task_id):
         return self.weburl + '/taskinfo?taskID=%i' % task_id
 
@@ -42,17 +132,229 @@ class Buildsys(object):
         ])
         return '%s/%r.%s' % (prefix, time.time(), suffix)
 
-    def upload_srpm(self, session, source):
-        log('Uploading {source} to koji'.format(source=source))
+    def _upload_chunk(self, session, source, serverdir, offset):
+        """ Send one chunk of source to koji and check it arrived intact.
+
+        Returns the number of bytes sent.
+        """
+        with open(source, 'rb') as f:
+            f.seek(offset)
+            chunk = f.read(self.chunk_size)
+
+        # The hub refuses to start a file that already exists unless told
+        # it may overwrite it, which a retry of the first chunk needs.
+        result = session.rawUpload(
+            chunk, offset, serverdir, os.path.basename(source),
+            overwrite=(offset == 0))
+
+        if result['size'] != len(chunk):
+            raise koji.GenericError('Chunk at %i: sent %i, hub got %i' % (
+                offset, len(chunk), result['size']))
+        if result['hexdigest'] != adler32(chunk):
+            raise koji.GenericError('Chunk at %i: checksum mismatch' % offset)
+
+        return len(chunk)
+
+    def _check_upload(self, session, source, serverdir):
+        result = session.checkUpload(
+            serverdir, os.path.basename(source), verify='adler32')
+
+        with open(source, 'rb') as f:
+            checksum = 1
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                checksum = zlib.adler32(chunk, checksum)
+
+        if not result or result['hexdigest'] != '%08x' % (
+                checksum & 0xffffffff):
+            raise koji.GenericError('Upload of %s failed verification' % (
+                source))
+
+    def _build(self, session, remote, target_tag):
+        return session.build(
+            remote, target_tag, self.opts, priority=self.priority)
+
+    @twisted.internet.defer.inlineCallbacks
+    def upload_srpm(self, name, branch, source):
+        """ Upload source to koji in chunks, strictly in order.
+
+        The hub truncates the file to a chunk's offset before writing it,
+        so chunks can't overlap in flight.  After a failure we carry on from
+        the end of the last chunk koji acknowledged; everything before it
+        is intact.
+        """
+        yield log('Uploading {source} to koji'.format(source=source))
         serverdir = self._unique_path('cli-build')
-        session.uploadWrapper(source, serverdir)
-        return "%s/%s" % (serverdir, os.path.basename(source))
+        size = os.path.getsize(source)
+        offset = 0
+        failures = 0
+        start = time.time()
+
+        while offset < size or (offset == 0 and size == 0):
+            try:
+                sent = yield self.call(
+                    self._upload_chunk, source, serverdir, offset)
+            except Exception as e:
+                failures += 1
+                yield log('Upload of %s failed at %i: %r' % (
+                    source, offset, e))
+                if failures > self.upload_retries:
+                    raise koji.GenericError(
+                        'Gave up uploading %s after %i failures' % (
+                            source, failures))
+                yield log('Resuming upload of %s at %i of %i bytes' % (
+                    source, offset, size))
+                continue
 
-    def scratch_build(self, session, name, source, target_tag):
-        remote = self.upload_srpm(session, source)
-        log('Intiating koji build for %r' % dict(
+            offset += sent
+            self.signal('upload', name, name, branch, offset, size)
+            if not sent:
+                break
+
+        yield self.call(self._check_upload, source, serverdir)
+
+        delta = max(time.time() - start, 0.001)
+        yield log('Uploaded %i bytes in %.1fs (%.1f KiB/s)' % (
+            size, delta, size / delta / 1024))
+
+        yield twisted.internet.defer.returnValue(
+            "%s/%s" % (serverdir, os.path.basename(source)))
+
+    @twisted.internet.defer.inlineCallbacks
+    def scratch_build(self, name, branch, source, target_tag):
+        remote = yield self.upload_srpm(name, branch, source)
+        yield log('Intiating koji build for %r' % dict(
             name=name, target=target_tag, source=remote, opts=self.opts))
-        task_id = session.build(
-            remote, target_tag, self.opts, priority=self.priority)
-        log('Done: task_id={task_id}'.format(task_id=task_id))
-        return task_id
+        task_id = yield self.call(self._build, remote, target_tag)
+        yield log('Done: task_id={task_id}'.format(task_id=task_id))
+        yield twisted.internet.defer.returnValue(task_id)
+
+    def _task_info(self, session, task_ids):
+        session.multicall = True
+        for task_id in task_ids:
+            session.getTaskInfo(task_id)
+        results = session.multiCall()
+
+        # Faults come back as dicts, successes as one-element lists.
+        return dict([
+            (task_id, result[0])
+            for task_id, result in zip(task_ids, results)
+            if isinstance(result, list)
+        ])
+
+    def task_info(self, task_ids):
+        """ Return a Deferred firing with a dict of task_id to koji task info.
+
+        All of the lookups go to koji in a single multicall.
+        """
+        return self.call(self._task_info, task_ids)
+
+    def _recent_builds(self, session, name, count):
+        package_id = session.getPackageID(name)
+        if package_id is None:
+            return []
+        builds = session.listBuilds(packageID=package_id, queryOpts=dict(
+            limit=count, order='-build_id'))
+        return [
+            (build['nvr'], koji.BUILD_STATES[build['state']])
+            for build in builds
+        ]
+
+    def recent_builds(self, name, count=5):
+        """ Fires with (nvr, state) of the latest few builds of a package.
+        """
+        return self.call(self._recent_builds, name, count)
+
+    def start_polling(self, tasks):
+        """ Keep `tasks` (a shipit.model.TaskList) up to date from koji. """
+        self.tasks = tasks
+        tasks.register('finished', None, self.task_finished)
+        shipit.reactor.reactor.callLater(self.poll_interval, self.poll)
+
+    @twisted.internet.defer.inlineCallbacks
+    def task_finished(self, task):
+        """ Learn how long a task took and record it in the history,
+        whether fedmsg or the poller saw it finish first.
+        """
+        info = self.outstanding.get(task.task_id)
+        try:
+            if not info or not info.get('completion_ts'):
+                infos = yield self.task_info([task.task_id])
+                info = infos.get(task.task_id)
+        except Exception as e:
+            yield log('Could not get info on %r from koji: %r' % (task, e))
+            return
+        if not info or not info.get('completion_ts'):
+            return
+
+        self.durations.append(info['completion_ts'] - info['create_ts'])
+        self.record_task(task, info)
+
+    @twisted.internet.defer.inlineCallbacks
+    def poll(self):
+        try:
+            changed = yield self.poll_once()
+        except Exception as e:
+            yield log('Failed to poll koji: %r' % e)
+            changed = False
+
+        self.poll_interval = self.next_poll_interval(changed)
+        shipit.reactor.reactor.callLater(self.poll_interval, self.poll)
+
+    @twisted.internet.defer.inlineCallbacks
+    def poll_once(self):
+        """ Check every outstanding task.  Returns True if any changed. """
+        tasks = self.tasks.unfinished()
+        if not tasks:
+            yield twisted.internet.defer.returnValue(False)
+
+        self.outstanding = infos = yield self.task_info(
+            [task.task_id for task in tasks])
+
+        changed = False
+        for task in tasks:
+            if task.task_id not in infos:
+                yield log('Could not get info on %r from koji' % task)
+                continue
+            info = infos[task.task_id]
+            state = task.state
+            self.tasks.update(task.task_id, info['state'])
+            if task.state != state:
+                changed = True
+
+        yield twisted.internet.defer.returnValue(changed)
+
+    def record_task(self, task, info):
+        """ Split a finished task's time into waiting and building. """
+        if not self.history:
+            return
+        status = 'ok' if task.state == 'CLOSED' else 'failed'
+        started = info.get('start_ts') or info['create_ts']
+        self.history.record(task.package, task.branch, 'koji-queue', None,
+                            started - info['create_ts'], 0, status)
+        self.history.record(task.package, task.branch, 'koji-build', None,
+                            info['completion_ts'] - started, 0, status)
+
+    def next_poll_interval(self, changed):
+        """ Back off while tasks are long-running, speed up near the end.
+
+        Any state change resets us to the shortest interval.  Otherwise the
+        interval doubles, but never past the time at which we expect some
+        running task to finish based on how long recent tasks took.
+        """
+        if changed or not self.tasks.unfinished():
+            return self.poll_min
+
+        interval = min(self.poll_max, self.poll_interval * 2)
+
+        if self.durations:
+            expected = sum(self.durations) / len(self.durations)
+            now = time.time()
+            for task in self.tasks.unfinished():
+                info = self.outstanding.get(task.task_id)
+                if not info:
+                    continue
+                remaining = expected - (now - info['create_ts'])
+                if remaining > 0:
+                    interval = min(interval, remaining)
+
+        return max(self.poll_min, interval)
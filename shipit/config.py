@@ -32,12 +32,78 @@ defaults = {
     'logsize': 30,
     'logfile': os.path.expanduser('~/.config/shipit/shipit.log'),
     'yum_conf': os.path.expanduser('~/.config/shipit/yum.conf'),
+    'snapshot': os.path.expanduser('~/.config/shipit/snapshot.json'),
+    'mirror_dir': os.path.expanduser('~/.cache/shipit/mirrors'),
+    'source_dir': os.path.expanduser('~/.cache/shipit/sources'),
+    'srpm_dir': os.path.expanduser('~/.cache/shipit/srpms'),
+    'memo_file': os.path.expanduser('~/.cache/shipit/steps.json'),
+    'history_file': os.path.expanduser('~/.cache/shipit/history.sqlite'),
+    # Set to a path to also keep every package in an indexed SQLite store.
+    'store_file': '',
+    # Where builds happen.  A tmpfs mount is a good choice.
+    'workspace_dir': '/var/tmp',
 
     'http.threads': 10,
 
+    # Where `shipit --daemon` listens, and where shipit looks for a daemon
+    # to attach to.  Point everyone on a shared host at the same path.
+    'daemon.socket': os.path.expanduser('~/.cache/shipit/daemon.sock'),
+
+    # How many of each command may run at once, by executable name.
+    'process.limits': 'default=8,git=4,fedpkg=2,spectool=4,rpmbuild=2',
+    # Seconds before a command is killed, and the grace period before the
+    # SIGTERM becomes a SIGKILL.
+    'process.timeout': 1800,
+    'process.kill_grace': 10,
+
+    # Seconds to wait for more anitya messages about the same package before
+    # applying the newest one.  Set to 0 to apply every message immediately.
+    'fedmsg.debounce': 2.0,
+    # How many recent msg_ids to remember when dropping duplicate messages.
+    'fedmsg.dedup_size': 1000,
+    # Page size used when replaying missed messages from datagrepper.
+    'fedmsg.catchup_rows': 100,
+
+    # How many anitya checks a batch runs at once, and how many requests a
+    # second (with bursts of up to anitya.burst) we send to any one host.
+    'anitya.concurrency': 8,
+    'anitya.rate': 2.0,
+    'anitya.burst': 5,
+
+    # Whose packages to show, as comma separated FAS usernames and groups.
+    # With no users, just your own username is used.
+    'pkgdb.users': '',
+    'pkgdb.groups': '',
+    # Which of their packages to show, and how many pkgdb pages to fetch at
+    # once.
+    'pkgdb.roles': 'point of contact,co-maintained,watch',
+    'pkgdb.concurrency': 4,
+
+    # Background refreshing of data fedmsg should have told us about: at
+    # most refresh.budget requests a minute (0 turns it off).  Packages are
+    # checked between refresh.min and refresh.max seconds apart, depending
+    # how often they change.  rawhide and pkgdb are reloaded every
+    # refresh.rawhide and refresh.pkgdb seconds.
+    'refresh.budget': 30,
+    'refresh.min': 15 * 60,
+    'refresh.max': 24 * 60 * 60,
+    'refresh.initial': 6 * 60 * 60,
+    'refresh.rawhide': 60 * 60,
+    'refresh.pkgdb': 6 * 60 * 60,
+
+    # Details of the rows around the cursor are fetched once it has rested
+    # for prefetch.delay seconds, a few at a time, and kept for
+    # prefetch.ttl seconds.
+    'prefetch.delay': 0.5,
+    'prefetch.neighbours': 3,
+    'prefetch.concurrency': 2,
+    'prefetch.ttl': 10 * 60,
+
     # URLs
     'pkgdb_url': 'https://admin.fedoraproject.org/pkgdb',
     'anitya_url': 'https://release-monitoring.org',
+    'datagrepper_url': 'https://apps.fedoraproject.org/datagrepper',
+    'bugzilla_url': 'https://bugzilla.redhat.com',
     'dist_git_url': 'http://pkgs.fedoraproject.org/cgit/{package}.git',
 
     'koji_server': 'https://koji.fedoraproject.org/kojihub',
@@ -45,6 +111,36 @@ defaults = {
 
     'koji_cert': os.path.expanduser('~/.fedora.cert'),
     'koji_ca_cert': os.path.expanduser('~/.fedora-server-ca.cert'),
+    # Size in bytes past which old dist-git mirrors are evicted.
+    'mirror.max_size': 2 * 1024 ** 3,
+    # Seconds for which a freshly fetched mirror is considered up to date.
+    'mirror.fresh': 60,
+    # Size in bytes past which old source tarballs are evicted.
+    'sources.max_size': 10 * 1024 ** 3,
+
+    # How many build workspaces may be in use at once, and how old (in
+    # seconds) a leftover one must be before it is removed.
+    'workspace.max': 8,
+    'workspace.stale': 24 * 60 * 60,
+
+    # Branches built by the fan-out command, e.g. rawhide,f21,epel7
+    'build.branches': 'rawhide',
+
+    # How many packages may be in each kind of build pipeline stage at once.
+    'pipeline.network_jobs': 4,
+    'pipeline.cpu_jobs': 2,
+    'pipeline.koji_jobs': 2,
+    # Remembered stage outputs older than this (in seconds) are forgotten.
+    'pipeline.memo_age': 30 * 24 * 60 * 60,
+
+    # Threads (and so logged-in sessions) used for talking to koji.
+    'koji.threads': 4,
+    # SRPMs are uploaded in order, in chunks of this many bytes.
+    'koji.upload_chunk': 1024 * 1024,
+    'koji.upload_retries': 3,
+    # Bounds, in seconds, on how often we poll koji for outstanding tasks.
+    'koji.poll_min': 10,
+    'koji.poll_max': 300,
 
 }
 
@@ -59,6 +155,26 @@ def load_config():
     return load_shipitrc_config(), load_fedmsg_config()
 
 
+def comma_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def limits_dict(value):
+    return dict([
+        (kind.strip(), int(limit)) for kind, limit in [
+            item.split('=') for item in value.split(',') if item.strip()]
+    ])
+
+
+def process_limits(value):
+    """ Limits given in shipitrc, over the ones we ship with, so that a
+    user needn't repeat every kind (or 'default') to change one.
+    """
+    limits = limits_dict(defaults['process.limits'])
+    limits.update(limits_dict(value))
+    return limits
+
+
 def load_shipitrc_config():
     config = copy.copy(defaults)
 
@@ -77,6 +193,44 @@ def load_shipitrc_config():
     typecasts = {
         'logsize': int,
         'http.threads': int,
+        'process.limits': process_limits,
+        'process.timeout': int,
+        'process.kill_grace': int,
+        'fedmsg.debounce': float,
+        'fedmsg.dedup_size': int,
+        'fedmsg.catchup_rows': int,
+        'anitya.concurrency': int,
+        'anitya.rate': float,
+        'anitya.burst': int,
+        'mirror.max_size': int,
+        'mirror.fresh': int,
+        'workspace.max': int,
+        'workspace.stale': int,
+        'build.branches': comma_list,
+        'pkgdb.users': comma_list,
+        'pkgdb.groups': comma_list,
+        'pkgdb.roles': comma_list,
+        'pkgdb.concurrency': int,
+        'prefetch.delay': float,
+        'prefetch.neighbours': int,
+        'prefetch.concurrency': int,
+        'prefetch.ttl': int,
+        'refresh.budget': int,
+        'refresh.min': int,
+        'refresh.max': int,
+        'refresh.initial': int,
+        'refresh.rawhide': int,
+        'refresh.pkgdb': int,
+        'sources.max_size': int,
+        'pipeline.network_jobs': int,
+        'pipeline.cpu_jobs': int,
+        'pipeline.koji_jobs': int,
+        'pipeline.memo_age': int,
+        'koji.threads': int,
+        'koji.upload_chunk': int,
+        'koji.upload_retries': int,
+        'koji.poll_min': int,
+        'koji.poll_max': int,
     }
 
     for key, cast in typecasts.items():
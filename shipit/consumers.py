@@ -18,12 +18,16 @@
 
 from __future__ import print_function
 
+import collections
 import traceback
 import uuid
 
 import fedmsg.consumers
+import twisted.internet.defer
 
 import shipit.log
+import shipit.reactor
+import shipit.utils
 
 
 def log_errors(fn):
@@ -40,24 +44,47 @@ class ShipitConsumer(fedmsg.consumers.FedmsgConsumer):
     config_key = unicode(uuid.uuid4())
     topic = '*'
 
-    def __init__(self, hub, model):
+    def __init__(self, hub, config, model):
         self.model = model
+
+        # anitya likes to send bursts of messages for the same project when it
+        # rescans.  We hold on to the newest payload for each package for a
+        # little while and only apply that one when the window closes.
+        self.debounce = config['fedmsg.debounce']
+        self.pending = {}
+        self.timers = {}
+
+        # Remember the last few msg_ids so we can drop duplicates.
+        self.seen = collections.deque(maxlen=config['fedmsg.dedup_size'])
+        self.seen_index = set()
+
+        self.stats = collections.Counter()
+
         super(ShipitConsumer, self).__init__(hub)
 
     @log_errors
     def consume(self, msg):
         topic, msg = msg['topic'], msg['body']
+        self.stats['received'] += 1
+
+        if self.is_duplicate(msg.get('msg_id')):
+            self.stats['duplicates'] += 1
+            return
 
         # Just dev debugging
         if 'anitya' in topic:
             shipit.log.log('received fedmsg %r' % topic)
 
-        if 'anitya.project.map' in topic:
+        if 'buildsys.task.state.change' in topic:
+            task = self.model.tasks.update(msg['msg']['id'], msg['msg']['new'])
+            if task:
+                shipit.log.log('%r is now %s' % (task, task.state))
+        elif 'anitya.project.map' in topic:
             message = msg['msg']['message']
             packagename = message['new']
             if message['distro'] == 'Fedora' and packagename in self.model:
                 shipit.log.log('Setting upstream on %r' % packagename)
-                self.model[packagename].set_upstream(msg['msg']['project'])
+                self.schedule_upstream(packagename, msg)
             else:
                 shipit.log.log('Did not set upstream.')
         elif 'anitya.project.version' in topic:
@@ -71,8 +98,101 @@ class ShipitConsumer(fedmsg.consumers.FedmsgConsumer):
             if not package:
                 return
 
-            self.model[package].set_upstream(msg['msg']['project'])
+            self.schedule_upstream(package, msg)
+
+    def is_duplicate(self, msg_id):
+        """ Return True if we have already seen this msg_id recently. """
+        if msg_id is None:
+            return False
+
+        if msg_id in self.seen_index:
+            return True
 
+        if len(self.seen) == self.seen.maxlen:
+            self.seen_index.discard(self.seen[0])
+        self.seen.append(msg_id)
+        self.seen_index.add(msg_id)
+        return False
+
+    def schedule_upstream(self, package, msg):
+        """ Queue an upstream update, coalescing bursts for one package.
+
+        Only the newest project payload (by message timestamp) received within
+        the debounce window is applied.
+        """
+        project = msg['msg']['project']
+        timestamp = msg.get('timestamp', 0)
+
+        if not self.debounce:
+            self.stats['applied'] += 1
+            return self.model[package].set_upstream(project)
+
+        if package in self.pending:
+            self.stats['coalesced'] += 1
+            if timestamp >= self.pending[package][0]:
+                self.pending[package] = (timestamp, project)
+            return
+
+        self.pending[package] = (timestamp, project)
+        self.timers[package] = shipit.reactor.reactor.callLater(
+            self.debounce, self.flush_upstream, package)
+
+    @log_errors
+    def flush_upstream(self, package):
+        self.timers.pop(package, None)
+        timestamp, project = self.pending.pop(package)
+        self.stats['applied'] += 1
+        self.model[package].set_upstream(project)
+
+    def flush_all(self):
+        """ Apply every update still waiting out its debounce window.
+
+        Called at shutdown, before the snapshot is saved, since the
+        snapshot's timestamp says we have seen everything up to now.
+        """
+        for package, timer in list(self.timers.items()):
+            if timer.active():
+                timer.cancel()
+            self.flush_upstream(package)
+
+    def stats_summary(self):
+        return ', '.join([
+            '%s=%i' % (key, self.stats[key]) for key in [
+                'received', 'duplicates', 'coalesced', 'applied']
+        ])
+
+
+@twisted.internet.defer.inlineCallbacks
+def catch_up(config, consumer, since):
+    """ Replay anitya messages published since our last session.
+
+    The history comes from a datagrepper-compatible endpoint, a page at a
+    time, and each message goes through the consumer exactly as if it had
+    come off the bus.
+    """
+    url = config['datagrepper_url'] + '/raw'
+    params = dict(
+        category='anitya',
+        start=since,
+        order='asc',
+        rows_per_page=config['fedmsg.catchup_rows'],
+        page=1,
+    )
+    yield shipit.log.log('Catching up on anitya messages since %s' % since)
+
+    replayed, pages = 0, 1
+    while params['page'] <= pages:
+        resp = yield shipit.utils.http.get(url, params=params)
+        data = resp.json()
+        pages = data.get('pages', 1)
+
+        for message in data.get('raw_messages', []):
+            consumer.consume(dict(topic=message['topic'], body=message))
+            replayed += 1
+
+        params['page'] += 1
+
+    yield shipit.log.log('Replayed %i missed messages' % replayed)
 
 
 all_consumers = [ShipitConsumer]
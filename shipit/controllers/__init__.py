@@ -49,6 +49,11 @@ class MasterController(object):
         import shipit.controllers.anitya
         import shipit.controllers.build
         import shipit.controllers.help
+        import shipit.prefetch
+
+        # Details of the rows around the cursor are fetched ahead of time.
+        self.prefetcher = shipit.prefetch.Prefetcher(config, model)
+        ui.listbox.focus_callbacks.append(self.prefetcher.focus_changed)
 
         self.contexts = {
             'main': shipit.controllers.main.MainContext(self),
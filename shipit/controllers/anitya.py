@@ -26,61 +26,22 @@ import webbrowser
 import twisted.internet.defer
 
 import shipit.controllers as base
+import shipit.ui
 import shipit.utils
 
 from shipit.log import log
 
 
-backends = {
-    'ftp.debian.org': 'Debian project',
-    'www.drupal.org': 'Drupal7',
-    'freecode.com': 'Freshmeat',
-    'github.com': 'GitHub',
-    'download.gnome.org': 'GNOME',
-    'ftp.gnu.org': 'GNU project',
-    'code.google.com': 'Google code',
-    'hackage.haskell.org': 'Hackage',
-    'launchpad.net': 'launchpad',
-    'www.npmjs.org': 'npmjs',
-    'packagist.org': 'Packagist',
-    'pear.php.net': 'PEAR',
-    'pecl.php.net': 'PECL',
-    'pypi.python.org': 'PyPI',
-    'rubygems.org': 'Rubygems',
-    'sourceforge.net': 'Sourceforge',
-}
-
-prefixes = [
-    'python-',
-    'php-',
-    'nodejs-',
-]
-
-easy_guesses = [
-    'Debian project',
-    'Drupal7',
-    'Freshmeat',
-    'GitHub',
-    'GNOME',
-    'GNU project',
-    'Google code',
-    'Hackage',
-    'launchpad',
-    'npmjs',
-    'PEAR',
-    'PECL',
-    'PyPI',
-    'Rubygems',
-    'Sourceforge',
-]
-
-
 class AnityaContext(base.BaseContext, base.Searchable):
     prompt = 'ANITYA'
 
     def __init__(self, *args, **kwargs):
         super(AnityaContext, self).__init__(*args, **kwargs)
-        self.anitya_url = self.controller.config['anitya_url']
+        config = self.controller.config
+        self.anitya_url = config['anitya_url']
+        self.check_concurrency = config['anitya.concurrency']
+        self.throttle = shipit.utils.HostThrottle(
+            config['anitya.rate'], config['anitya.burst'])
         self.command_map.update(collections.OrderedDict([
             ('q', self.switch_main),
             ('esc', self.switch_main),
@@ -91,6 +52,9 @@ class AnityaContext(base.BaseContext, base.Searchable):
         self.filter_map.update(collections.OrderedDict([
             ('m', self.toggle_mismatch_filter),
             ('a', self.toggle_missing_filter),
+            ('b', self.toggle_backend_filter),
+            ('s', self.toggle_staleness_sort),
+            ('l', self.toggle_checked_sort),
         ]))
 
     def assume_primacy(self):
@@ -106,18 +70,41 @@ class AnityaContext(base.BaseContext, base.Searchable):
             return None
 
         # Otherwise, add it.
+        statuses = self.controller.model.statuses
+
         def callback(package):
-            rawhide, upstream = package.get_rawhide(), package.get_upstream()
-            if '(' in rawhide or '(' in upstream:
-                return False
-            elif rawhide != upstream:
-                return True
-            else:
-                return False
+            return package.name in statuses['outdated'] or \
+                package.name in statuses['ahead']
 
         self.controller.ui.listbox.add_filter('anitya_mismatch', callback)
         self.controller.ui.listbox.filter_results()
 
+    def toggle_staleness_sort(self, key):
+        """ Sort Stale | Toggle listing the most out of date packages first.
+        """
+        listbox = self.controller.ui.listbox
+        if listbox.sort_name == 'anitya_staleness':
+            listbox.set_sort(None)
+            return None
+
+        listbox.set_sort(shipit.ui.PackageRow.staleness, 'anitya_staleness')
+
+    def toggle_checked_sort(self, key):
+        """ Sort Checked | Toggle listing the longest unchecked packages
+        first.
+        """
+        listbox = self.controller.ui.listbox
+        if listbox.sort_name == 'anitya_checked':
+            listbox.set_sort(None)
+            return None
+
+        ranks = dict([
+            (name, i) for i, name in
+            enumerate(self.controller.model.order('last_checked'))
+        ])
+        listbox.set_sort(
+            lambda row: ranks.get(row.name, -1), 'anitya_checked')
+
     def toggle_missing_filter(self, key):
         """ Show Missing | Toggle showing only packages missing from anitya.
         """
@@ -128,12 +115,40 @@ class AnityaContext(base.BaseContext, base.Searchable):
             return None
 
         # Otherwise, add it.
+        missing = self.controller.model.statuses['missing']
+
         def callback(package):
-            return package.get_upstream() == '(not found)'
+            return package.name in missing
 
         self.controller.ui.listbox.add_filter('anitya_missing', callback)
         self.controller.ui.listbox.filter_results()
 
+    def toggle_backend_filter(self, key):
+        """ Same Backend | Toggle showing only packages with the backend of
+        the focused one.
+        """
+
+        # First try to remove it.  If it was there, then bail
+        if self.controller.ui.listbox.remove_filter('anitya_backend'):
+            self.controller.ui.listbox.filter_results()
+            return None
+
+        # Otherwise, add it, if there's a package to take the backend from.
+        package = getattr(self.controller.ui.get_active_row(), 'package', None)
+        if package is None:
+            log('No package selected to filter by backend')
+            return None
+        backend = package.backend
+
+        # Looked up as each row is checked, so that packages loaded later
+        # are shown too.
+        def callback(row):
+            return row.package.backend == backend
+
+        log('Showing only packages using backend %r' % backend)
+        self.controller.ui.listbox.add_filter('anitya_backend', callback)
+        self.controller.ui.listbox.filter_results()
+
     def open_anitya(self, key, rows):
         """ Open | Open an anitya project in your web browser. """
         anitya_url = self.anitya_url
@@ -142,22 +157,7 @@ class AnityaContext(base.BaseContext, base.Searchable):
             if idx:
                 url = '%s/project/%i' % (anitya_url, idx)
             else:
-                name = row.name
-                the_backend = None
-
-                # Try to guess at what backend it is...
-                for target, backend in backends.items():
-                    if target in row.package.pkgdb['upstream_url']:
-                        the_backend = backend
-                        break
-
-                # For these, we can get a pretty good guess at the upstream name
-                for guess in easy_guesses:
-                    if the_backend == guess:
-                        homepage = row.package.pkgdb['upstream_url']
-                        name = homepage.strip('/').split('/')[-1]
-                        break
-
+                name = row.package.classification.name
                 url = '%s/projects/search/?pattern=%s' % (anitya_url, name)
             log("Opening %r" % url)
             webbrowser.open_new_tab(url)
@@ -168,32 +168,15 @@ class AnityaContext(base.BaseContext, base.Searchable):
         anitya_url = self.anitya_url
 
         for row in rows:
+            backend, name = row.package.classification
             data = dict(
-                name=row.package.pkgdb['name'],
+                name=name,
                 homepage=row.package.pkgdb['upstream_url'],
                 distro='Fedora',
                 package_name=row.package.pkgdb['name'],
             )
-
-            # Try to guess at what backend to prefill...
-            if row.package.pkgdb.get('upstream_url'):
-                for target, backend in backends.items():
-                    if target in row.package.pkgdb['upstream_url']:
-                        data['backend'] = backend
-                        break
-
-            # It's not always the case that these need removed, but often
-            # enough...
-            for prefix in prefixes:
-                if data['name'].startswith(prefix):
-                    data['name'] = data['name'][len(prefix):]
-
-            # For these, we can get a pretty good guess at the upstream name
-            if 'backend' in data:
-                for guess in easy_guesses:
-                    if data['backend'] == guess:
-                        data['name'] = data['homepage']
-                        data['name'] = data['name'].strip('/').split('/')[-1]
+            if backend:
+                data['backend'] = backend
 
             url = anitya_url + '/project/new?' + urllib.urlencode(data)
             log("Opening %r" % url)
@@ -202,17 +185,55 @@ class AnityaContext(base.BaseContext, base.Searchable):
     @twisted.internet.defer.inlineCallbacks
     def check_anitya(self, key, rows):
         """ Check | Force a check of the latest upstream package. """
-        anitya_url = self.anitya_url
+        results = collections.defaultdict(list)
+        semaphore = twisted.internet.defer.DeferredSemaphore(
+            self.check_concurrency)
+
         for row in rows:
-            idx = row.upstream.get('id')
-            if not idx:
-                log("Cannot check anitya.  Anitya has no record of this.")
-                return
+            row.package.set_stage('queued')
+        yield twisted.internet.defer.DeferredList([
+            semaphore.run(self.check_one, row, results) for row in rows
+        ])
+
+        yield log('Checked %i of %i packages with anitya' % (
+            len(results['checked']), len(rows)))
+        for outcome in ['missing', 'error', 'failed']:
+            names = results[outcome]
+            if names:
+                yield log('  %s (%i): %s' % (
+                    outcome, len(names), ', '.join(sorted(names)[:20])))
 
-            url = '%s/api/version/get' % anitya_url
+    @twisted.internet.defer.inlineCallbacks
+    def check_one(self, row, results):
+        """ Ask anitya to check one package, noting how it went. """
+        idx = row.upstream.get('id')
+        if not idx:
+            results['missing'].append(row.name)
+            row.package.set_stage('no anitya')
+            return
+
+        url = '%s/api/version/get' % self.anitya_url
+        yield self.throttle.wait(url)
+        row.package.set_stage('checking')
+        try:
             resp = yield shipit.utils.http.post(url, data=dict(id=idx))
             data = resp.json()
-            if 'error' in data:
-                log('Anitya error: %r' % data['error'])
-            else:
-                row.package.set_upstream(data)
+        except Exception as e:
+            results['failed'].append(row.name)
+            row.package.set_stage('!check')
+            yield log('Could not check %r: %r' % (row.name, e))
+            return
+
+        if 'error' in data:
+            results['error'].append(row.name)
+            row.package.set_stage('!check')
+            yield log('Anitya error for %r: %r' % (row.name, data['error']))
+            return
+
+        results['checked'].append(row.name)
+        row.package.set_upstream(data)
+        # Give the column back to the build, if there is one.
+        if row.package.build:
+            row.package.set_build(row.package.build)
+        else:
+            row.package.set_stage('')
@@ -19,18 +19,28 @@
 from __future__ import print_function
 
 import collections
+import hashlib
 import os
 import shutil
-import tempfile
-import traceback
 
 import twisted.internet.defer
+import twisted.internet.threads
 
 import shipit.controllers as base
+import shipit.model
+import shipit.pipeline
+import shipit.spec
+import shipit.utils
 
 from shipit.log import log
 from shipit.utils import run
-from shipit.buildsys import Buildsys
+
+
+def branch_refs(branch):
+    """ Return the dist-git ref and koji target for a branch name. """
+    if branch == 'rawhide':
+        return 'master', 'rawhide'
+    return branch, branch + '-candidate'
 
 
 class BuildContext(base.BaseContext, base.Searchable):
@@ -41,14 +51,51 @@ class BuildContext(base.BaseContext, base.Searchable):
         self.prompt = self.prompt % branch
 
         config = controller.config
-        self.git_url = config['dist_git_url']
         self.userstring = config['git_userstring']
 
-        self.koji = Buildsys(config)
+        self.koji = controller.model.buildsys
+        self.mirrors = controller.model.mirrors
+        self.sources = controller.model.sources
+        self.workspaces = controller.model.workspaces
+        self.koji.register('upload', None, self.upload_progress)
+        # Both keyed by (package, branch), since a fan out uploads an SRPM
+        # per branch of the same package at once.
+        self.uploading = {}
+        self.upload_logged = {}
+
+        self.ref, self.target_tag = branch_refs(self.branch)
+        self.fanout_branches = config['build.branches']
 
-        self.target_tag = {
-            'rawhide': 'rawhide',
-        }[self.branch]
+        self.srpm_dir = config['srpm_dir']
+
+        # Like a Makefile: the SRPM is only rebuilt if the spec in dist-git
+        # or the upstream version changed, and it is only sent to koji again
+        # if the SRPM changed or its last scratch build failed.
+        Stage = shipit.pipeline.Stage
+        self.pipeline = shipit.pipeline.Pipeline(config, [
+            Stage('mirror', 'network', self.stage_mirror,
+                  outputs=['spec_hash']),
+            # Not limited by kind, since it waits on the workspace pool.
+            Stage('workspace', None, self.stage_workspace),
+            Stage('clone', 'cpu', self.stage_clone,
+                  requires=['mirror', 'workspace']),
+            Stage('bump', 'cpu', self.stage_bump, requires=['clone']),
+            Stage('sources', 'network', self.stage_sources,
+                  requires=['clone']),
+            Stage('spectool', 'network', self.stage_spectool,
+                  requires=['bump']),
+            Stage('srpm', 'cpu', self.stage_srpm,
+                  requires=['sources', 'spectool'],
+                  inputs=['spec_hash', 'upstream'],
+                  outputs=['srpm', 'srpm_sha256'],
+                  valid=lambda outputs: os.path.exists(outputs['srpm'])),
+            Stage('koji', 'koji', self.stage_koji,
+                  requires=['srpm'],
+                  inputs=['srpm_sha256', 'target_tag'],
+                  outputs=['task_id'],
+                  valid=self.task_still_good),
+        ], controller.model.memo, controller.model.history)
+        self.history = controller.model.history
 
         super(BuildContext, self).__init__(controller, *args, **kwargs)
         self.command_map.update(collections.OrderedDict([
@@ -56,6 +103,10 @@ class BuildContext(base.BaseContext, base.Searchable):
             ('esc', self.switch_main),
 
             ('r', self.open_scratch_build),
+            ('f', self.fanout_scratch_build),
+            ('x', self.cancel_pending),
+            ('w', self.workspace_report),
+            ('h', self.history_report),
         ]))
         #self.filter_map.update({
         #})
@@ -63,63 +114,195 @@ class BuildContext(base.BaseContext, base.Searchable):
     def assume_primacy(self):
         log('build %r assuming primacy' % self.branch)
 
-    @twisted.internet.defer.inlineCallbacks
+    def upload_progress(self, package, branch, uploaded, total):
+        """ Log SRPM upload progress every 10%. """
+        key = (package, branch)
+        job = self.uploading.get(key)
+        if job is None:
+            return
+        percent = 100 * uploaded / max(total, 1)
+        job.status('up %i%%' % percent)
+        if percent - self.upload_logged.get(key, -10) >= 10:
+            self.upload_logged[key] = percent
+            log('Uploaded %i%% of %r' % (percent, job))
+
+    def cancel_pending(self, key, rows):
+        """ Cancel | Cancel commands still waiting to run """
+        log('Cancelled %i pending commands' % (
+            shipit.utils.executor.cancel_pending()))
+
+    def workspace_report(self, key, rows):
+        """ Workspaces | Log build workspace disk usage and wait times """
+        return self.workspaces.report()
+
+    def history_report(self, key, rows):
+        """ History | Log where build time goes and estimate these rows """
+        for line in self.history.stage_report():
+            log(line)
+        for name, seconds in self.history.slowest_packages():
+            log('Slow to build: %s (%.1fs)' % (name, seconds))
+
+        limits = dict([
+            (kind, semaphore.limit)
+            for kind, semaphore in self.pipeline.limits.items()
+        ])
+        estimate = self.history.estimate([row.name for row in rows], limits)
+        log('Building %i packages should take about %im' % (
+            len(rows), estimate / 60))
+
     def open_scratch_build(self, key, rows):
         """ Scratch | Kick off a scratch build of a package """
+        return self.pipeline.run(self.make_jobs(rows, [self.branch]))
+
+    def fanout_scratch_build(self, key, rows):
+        """ Fan out | Scratch build a package on every configured branch """
+        return self.pipeline.run(self.make_jobs(rows, self.fanout_branches))
+
+    def make_jobs(self, rows, branches):
+        """ One job per package per branch.
+
+        Jobs for the same package share its dist-git mirror and source
+        tarballs, and where their specs are identical the pipeline builds
+        the SRPM only once.
+        """
+        jobs = []
         for row in rows:
-            package = row.name
             upstream = row.package.upstream['version']
             if not upstream:
-                log("Cannot bump %r, no upstream version found." % package)
+                log("Cannot bump %r, no upstream version found." % row.name)
                 continue
+            for branch in branches:
+                ref, target_tag = branch_refs(branch)
+                job = shipit.pipeline.Job(
+                    row.package, upstream=upstream, branch=branch, ref=ref,
+                    target_tag=target_tag)
+                if len(branches) > 1:
+                    job.prefix = branch + ' '
+                jobs.append(job)
+        return jobs
 
-            # Clone the package to a tempdir
-            tmp = tempfile.mkdtemp(prefix='shipit-', dir='/var/tmp')
+    @twisted.internet.defer.inlineCallbacks
+    def task_still_good(self, outputs):
+        """ A remembered scratch build counts unless it failed.
+
+        Tasks from earlier sessions aren't in our task list, so koji is asked.
+        """
+        task_id = outputs['task_id']
+        task = self.controller.model.tasks.get(task_id)
+        if task is not None:
+            state = task.state
+        else:
             try:
-                url = self.git_url.format(package=package)
-                log("Cloning %r to %r" % (url, tmp))
-                output = yield run(['git', 'clone', url, tmp])
-
-                specfile = tmp + '/' + package + '.spec'
-
-                # This requires rpmdevtools-8.5 or greater
-                cmd = [
-                    '/usr/bin/rpmdev-bumpspec',
-                    '--new', upstream,
-                    '-c', '"Latest upstream, %s"' % upstream,
-                    '-u', '"%s"' % self.userstring,
-                    specfile,
-                ]
-                output = yield run(cmd)
-
-                # First, get all patches and other sources from dist-git
-                output = yield run(['fedpkg', 'sources'], cwd=tmp)
-
-                # Then go and get the *new* tarball from upstream.
-                # For these to work, it requires that rpmmacros be redefined to
-                # find source files in the tmp directory.
-                output = yield run(['spectool', '-g', specfile], cwd=tmp)
-                macros = [
-                    '-D', '%_topdir .',
-                    '-D', '%_sourcedir .',
-                    '-D', '%_srcrpmdir .',
-                ]
-                output = yield run(
-                    ['rpmbuild'] + macros + ['-bs', specfile], cwd=tmp)
-
-                srpm = os.path.join(tmp, output.strip().split()[-1])
-
-                session = self.koji.session_maker()
-                task_id = self.koji.scratch_build(
-                    session, package, srpm, self.target_tag)
-
-                shutil.rmtree(tmp)
-
-                # TODO - register the task_id mapped to the package name with
-                # the consumer so we can watch for success.
-
-                yield twisted.internet.defer.returnValue(task_id)
-            except:
-                for line in traceback.format_exc().strip().split('\n'):
-                    log(line)
-                raise
+                infos = yield self.koji.task_info([task_id])
+            except Exception as e:
+                yield log('Could not check task %r: %r' % (task_id, e))
+                infos = {}
+            if not infos.get(task_id):
+                yield twisted.internet.defer.returnValue(False)
+            state = shipit.model.task_states[infos[task_id]['state']]
+        yield twisted.internet.defer.returnValue(
+            state not in ['FAILED', 'CANCELED'])
+
+    @twisted.internet.defer.inlineCallbacks
+    def stage_mirror(self, job):
+        yield self.mirrors.update(job.name)
+        job.bytes['mirror'] = self.mirrors.transferred.get(job.name, 0)
+        job.spec_hash = yield self.mirrors.rev_parse(
+            job.name, '%s:%s.spec' % (job.ref, job.name))
+
+    @twisted.internet.defer.inlineCallbacks
+    def stage_workspace(self, job):
+        job.tmp = yield self.workspaces.acquire()
+        # The checkout goes in a directory of its own, since git won't put
+        # a worktree into a directory that isn't empty.
+        job.workdir = os.path.join(job.tmp, job.name)
+        job.specfile = job.workdir + '/' + job.name + '.spec'
+        job.cleanups.append(lambda: self.workspaces.release(job.tmp))
+
+    def stage_clone(self, job):
+        # Check the package out of our local dist-git mirror into a workspace
+        job.cleanups.append(
+            lambda: self.mirrors.release(job.name, job.workdir))
+        log("Checking out %r %s to %r" % (job.name, job.ref, job.workdir))
+        return self.mirrors.checkout(job.name, job.workdir, job.ref)
+
+    def stage_bump(self, job):
+        # Same as rpmdev-bumpspec --new, without the extra process.
+        spec = shipit.spec.Spec.read(job.specfile)
+        spec.bump(job.upstream, 'Latest upstream, %s' % job.upstream,
+                  self.userstring)
+        spec.write(job.specfile)
+        job.source_urls = spec.source_urls()
+
+    @twisted.internet.defer.inlineCallbacks
+    def stage_sources(self, job):
+        # First, get all patches and other sources from dist-git
+        job.bytes['sources'] = yield self.sources.fetch_lookaside(job.workdir)
+
+    @twisted.internet.defer.inlineCallbacks
+    def stage_spectool(self, job):
+        # Then go and get the *new* tarball from upstream.
+        # For these to work, it requires that rpmmacros be redefined to
+        # find source files in the tmp directory.  If the spec uses macros
+        # we can't expand ourselves, let spectool work out the urls.
+        if any(['%' in url for url in job.source_urls]):
+            job.bytes['spectool'] = yield self.sources.fetch_spec_sources(
+                job.specfile, job.workdir)
+        else:
+            job.bytes['spectool'] = yield self.sources.fetch_urls(
+                job.source_urls, job.workdir)
+
+    @twisted.internet.defer.inlineCallbacks
+    def stage_srpm(self, job):
+        macros = [
+            '-D', '%_topdir .',
+            '-D', '%_sourcedir .',
+            '-D', '%_srcrpmdir .',
+        ]
+        output = yield run(
+            ['rpmbuild'] + macros + ['-bs', job.specfile], cwd=job.workdir)
+        srpm = os.path.join(job.workdir, output.strip().split()[-1])
+
+        # Keep it outside the workspace so later runs can reuse it.
+        job.srpm, job.srpm_sha256 = \
+            yield twisted.internet.threads.deferToThread(
+                self.store_srpm, job.name, srpm)
+
+    def store_srpm(self, package, srpm, keep=5):
+        """ Move an SRPM into our cache, keeping the newest few per package.
+
+        Returns the new path and its sha256.  Blocking.
+        """
+        directory = os.path.join(self.srpm_dir, package)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        dest = os.path.join(directory, os.path.basename(srpm))
+        shutil.move(srpm, dest)
+
+        sha256 = hashlib.sha256()
+        with open(dest, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                sha256.update(chunk)
+
+        old = sorted(
+            [os.path.join(directory, name) for name in os.listdir(directory)],
+            key=os.path.getmtime, reverse=True)[keep:]
+        for path in old:
+            os.unlink(path)
+
+        return dest, sha256.hexdigest()
+
+    @twisted.internet.defer.inlineCallbacks
+    def stage_koji(self, job):
+        job.bytes['koji'] = os.path.getsize(job.srpm)
+        self.uploading[(job.name, job.branch)] = job
+        try:
+            job.task_id = yield self.koji.scratch_build(
+                job.name, job.branch, job.srpm, job.target_tag)
+        finally:
+            self.uploading.pop((job.name, job.branch), None)
+            self.upload_logged.pop((job.name, job.branch), None)
+
+        # The consumer (or the fallback poller) takes it from here.
+        self.controller.model.tasks.add(job.task_id, job.name, job.branch)
+        yield twisted.internet.defer.returnValue(job.task_id)
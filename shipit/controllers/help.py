@@ -58,13 +58,11 @@ class HelpContext(shipit.controllers.BaseContext):
 
     def switch_main(self, key, rows):
         """ Back | Close this help menu. """
-        self.controller.ui.listbox.clear()
-        self.controller.ui.listbox.set_originals(self.saved_originals)
+        self.controller.ui.listbox.uncover()
         self.controller.ui.window.set_header(self.saved_header)
         super(HelpContext, self).switch_main(key, rows)
 
     def assume_primacy(self):
-        self.saved_originals = self.controller.ui.listbox.originals
         self.saved_header = self.controller.ui.window.header
 
         help_dict = self.build_help_dict()
@@ -86,8 +84,7 @@ class HelpContext(shipit.controllers.BaseContext):
                 keys = "|".join(collapsed[section][doc])
                 rows.append(DocRow('', keys, doc))
 
-        self.controller.ui.listbox.clear()
-        self.controller.ui.listbox.set_originals(rows)
+        self.controller.ui.listbox.cover(rows)
         self.controller.ui.window.set_header(DocRow.legend)
 
     def build_help_dict(self):
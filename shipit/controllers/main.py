@@ -24,6 +24,7 @@ import urwid
 import twisted.internet.defer
 
 import shipit.controllers as base
+import shipit.utils
 
 from shipit.log import log
 
@@ -40,6 +41,7 @@ class MainContext(base.BaseContext, base.Searchable):
             ('a', self.switch_anitya),
             ('b', self.switch_rawhide),
             ('d', self.debug),
+            ('i', self.details),
         ]))
         #self.filter_map.update(collections.OrderedDict([
         #]))
@@ -63,6 +65,19 @@ class MainContext(base.BaseContext, base.Searchable):
         """ Help | Help on available commands.. i.e., this menu """
         self.controller.set_context('help')
 
+    @twisted.internet.defer.inlineCallbacks
+    def details(self, key, rows):
+        """ Details | Log anitya mappings, koji builds and open bugs. """
+        for row in rows:
+            details = yield self.controller.prefetcher.details(row.package)
+            yield log('%s mapped in anitya as: %s' % (
+                row.name, ', '.join(details['mappings'] or []) or 'nothing'))
+            for nvr, state in details['builds'] or []:
+                yield log('  koji: %s %s' % (nvr, state))
+            for bug in details['bugs'] or []:
+                yield log('  bug %i [%s] %s' % (
+                    bug['id'], bug['status'], bug['summary']))
+
     @twisted.internet.defer.inlineCallbacks
     def debug(self, key, rows):
         """ Debug | Log some debug information about the highlighted row. """
@@ -70,3 +85,5 @@ class MainContext(base.BaseContext, base.Searchable):
             yield log('pkgdb: %r' % row.package.pkgdb)
             yield log('rawhide: %r' % (row.package.rawhide,))
             yield log('upstream: %r' % row.package.upstream)
+        for line in shipit.utils.executor.summary():
+            yield log('process %s' % line)
@@ -0,0 +1,241 @@
+# This file is part of shipit, a curses-based, fedmsg-aware heads up display
+# for Fedora package maintainers.
+# Copyright (C) 2014  Ralph Bean <rbean@redhat.com>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import errno
+import json
+import os
+import socket
+
+import twisted.internet.endpoints
+import twisted.internet.protocol
+import twisted.protocols.basic
+
+import shipit.reactor
+from shipit.log import log
+
+
+def package_state(package):
+    """ What a client needs to show a package. """
+    return dict(
+        pkgdb=package.pkgdb,
+        owner=package.owner,
+        rawhide=package.rawhide,
+        upstream=package.upstream,
+        last_checked=package.last_checked,
+    )
+
+
+def connect_error(path):
+    """ The errno from connecting to path, or None if it worked.  Blocking,
+    but only briefly.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return None
+    except socket.error as e:
+        return e.errno
+    finally:
+        sock.close()
+
+
+def packagers(path):
+    """ Whose packages the daemon on path serves, or None if there is no
+    daemon we can use.  Blocking, but only briefly.
+    """
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(5)
+    try:
+        sock.connect(path)
+        message = json.loads(sock.makefile('r').readline(4096))
+    except (socket.error, ValueError):
+        # Refused, gone, not ours to connect to or not talking sense:
+        # either way, not a daemon we can use.
+        return None
+    finally:
+        sock.close()
+    if message.get('type') != 'packagers':
+        return None
+    return message['packagers']
+
+
+class JSONLines(twisted.protocols.basic.LineReceiver):
+    """ One JSON message per line. """
+    delimiter = b'\n'
+
+    def send(self, **message):
+        self.sendLine(json.dumps(message))
+
+
+class DaemonProtocol(JSONLines):
+    """ Sends a client everything we know and then every change. """
+    # Clients have nothing to say, so don't buffer much of it.
+    MAX_LENGTH = 4096
+
+    def connectionMade(self):
+        self.factory.clients.add(self)
+        # First, whose packages these are, so a client can tell whether
+        # they are the ones it wants.
+        self.send(type='packagers', packagers=self.factory.model.packagers())
+        self.send(type='packages', packages=[
+            package_state(package) for package in self.factory.model.values()
+        ])
+        if self.factory.initialized:
+            self.send(type='initialized')
+
+    def connectionLost(self, reason):
+        self.factory.clients.discard(self)
+
+    def lineReceived(self, line):
+        # Clients only listen.
+        pass
+
+
+class DaemonFactory(twisted.internet.protocol.ServerFactory):
+    """ Shares one PackageList with every attached shipit.
+
+    The daemon does the repoquery, pkgdb and anitya fetching and holds the
+    only fedmsg subscription; clients get the results.
+    """
+    protocol = DaemonProtocol
+
+    def __init__(self, model):
+        self.model = model
+        self.clients = set()
+        self.initialized = False
+        model.register('pkgdb', None, self.packages_added)
+        model.register('initialized', None, self.model_initialized)
+
+    def broadcast(self, **message):
+        line = json.dumps(message)
+        for client in self.clients:
+            client.sendLine(line)
+
+    def packages_added(self, packages):
+        for name, package in packages:
+            for event in ['rawhide', 'upstream']:
+                package.register(event, None, self.forward(name, event))
+        self.broadcast(type='packages', packages=[
+            package_state(package) for name, package in packages
+        ])
+
+    def forward(self, name, event):
+        return lambda value: self.broadcast(type=event, name=name, value=value)
+
+    def model_initialized(self, packages):
+        self.initialized = True
+        self.broadcast(type='initialized')
+
+
+def serve(config, model):
+    """ Listen for clients on the daemon socket. """
+    path = config['daemon.socket']
+    if os.path.exists(path):
+        error = connect_error(path)
+        if error is None:
+            raise ValueError(
+                'A shipit daemon is already listening on %s' % path)
+        # Only a socket nobody is listening on is ours to replace.  One we
+        # may not connect to could well belong to a live daemon.
+        if error not in (errno.ECONNREFUSED, errno.ENOENT):
+            raise ValueError('Cannot tell whether %s is in use: %s' % (
+                path, os.strerror(error)))
+        os.unlink(path)
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    # Other packagers on the box may attach.  We only ever send them public
+    # package data and ignore anything they say.
+    factory = DaemonFactory(model)
+    shipit.reactor.reactor.listenUNIX(path, factory, mode=0o666)
+    log('Serving packages on %s' % path)
+    return factory
+
+
+class ClientProtocol(JSONLines):
+    """ Mirrors a daemon's packages into our own PackageList. """
+    # The first message carries every package the daemon knows about.
+    MAX_LENGTH = 256 * 1024 ** 2
+
+    def __init__(self, model):
+        self.model = model
+
+    def lineReceived(self, line):
+        message = json.loads(line)
+        handler = getattr(self, 'handle_' + message.pop('type'), None)
+        if handler:
+            handler(**message)
+
+    def handle_packages(self, packages):
+        added = []
+        for state in packages:
+            name = state['pkgdb']['name']
+            if name in self.model:
+                package = self.model[name]
+            else:
+                package = self.model.add_package(
+                    state['pkgdb'], owner=state['owner'])
+                added.append(package)
+            if state['rawhide']:
+                package.set_rawhide(tuple(state['rawhide']))
+            if state['upstream'] is not None:
+                package.set_upstream(
+                    state['upstream'], state.get('last_checked'))
+
+        if added:
+            self.model.signal('pkgdb', [
+                (package.name, package) for package in added
+            ])
+
+    def handle_rawhide(self, name, value):
+        if name in self.model:
+            self.model[name].set_rawhide(tuple(value))
+
+    def handle_upstream(self, name, value):
+        if name in self.model:
+            self.model[name].set_upstream(value)
+
+    def handle_initialized(self):
+        self.model.signal('initialized', self.model.items())
+
+    def connectionLost(self, reason):
+        log('Lost connection to the shipit daemon: %s' % (
+            reason.getErrorMessage()))
+
+
+class ClientFactory(twisted.internet.protocol.Factory):
+    def __init__(self, model):
+        self.model = model
+
+    def buildProtocol(self, addr):
+        return ClientProtocol(self.model)
+
+
+def attach(config, model):
+    """ Get our packages from the daemon instead of loading them ourselves.
+    """
+    path = config['daemon.socket']
+    log('Attaching to the shipit daemon on %s' % path)
+    endpoint = twisted.internet.endpoints.UNIXClientEndpoint(
+        shipit.reactor.reactor, path)
+    return endpoint.connect(ClientFactory(model))
@@ -0,0 +1,135 @@
+# This file is part of shipit, a curses-based, fedmsg-aware heads up display
+# for Fedora package maintainers.
+# Copyright (C) 2014  Ralph Bean <rbean@redhat.com>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import collections
+import os
+import sqlite3
+import time
+
+import shipit.utils
+
+
+schema = """
+CREATE TABLE IF NOT EXISTS stages (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    package TEXT NOT NULL,
+    branch TEXT,
+    stage TEXT NOT NULL,
+    kind TEXT,
+    duration REAL NOT NULL,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stages_stage ON stages (stage);
+CREATE INDEX IF NOT EXISTS stages_package ON stages (package);
+"""
+
+
+class History(object):
+    """ How long every build stage took, kept in a local SQLite database. """
+
+    def __init__(self, config):
+        self.filename = config['history_file']
+        directory = os.path.dirname(self.filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.db = sqlite3.connect(self.filename)
+        self.db.executescript(schema)
+
+    def __repr__(self):
+        return "<History %r>" % self.filename
+
+    def record(self, package, branch, stage, kind, duration, bytes=0,
+               status='ok'):
+        with self.db:
+            self.db.execute(
+                "INSERT INTO stages (timestamp, package, branch, stage, kind, "
+                "duration, bytes, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), package, branch, stage, kind, duration, bytes,
+                 status))
+
+    def stage_durations(self):
+        """ Successful durations of each stage, keyed by (stage, kind). """
+        durations = collections.OrderedDict()
+        rows = self.db.execute(
+            "SELECT stage, kind, duration FROM stages WHERE status = 'ok' "
+            "ORDER BY id")
+        for stage, kind, duration in rows:
+            durations.setdefault((stage, kind), []).append(duration)
+        return durations
+
+    def stage_report(self):
+        """ One line per stage with its percentiles and mean transfer. """
+        transferred = dict(self.db.execute(
+            "SELECT stage, AVG(bytes) FROM stages GROUP BY stage"))
+        lines = []
+        for (stage, kind), durations in self.stage_durations().items():
+            lines.append(
+                '%s (%s): %i runs, p50 %.1fs, p90 %.1fs, p95 %.1fs, '
+                '%i KiB avg' % (
+                    stage, kind, len(durations),
+                    shipit.utils.percentile(durations, 0.5),
+                    shipit.utils.percentile(durations, 0.9),
+                    shipit.utils.percentile(durations, 0.95),
+                    (transferred.get(stage) or 0) / 1024))
+        return lines
+
+    def package_totals(self):
+        """ Typical time for a whole build of each package.
+
+        That is the sum over stages of the package's mean time in each.
+        """
+        totals = collections.defaultdict(float)
+        rows = self.db.execute(
+            "SELECT package, stage, AVG(duration) FROM stages "
+            "WHERE status = 'ok' GROUP BY package, stage")
+        for package, stage, duration in rows:
+            totals[package] += duration
+        return totals
+
+    def slowest_packages(self, count=5):
+        totals = self.package_totals()
+        return sorted(totals.items(), key=lambda item: -item[1])[:count]
+
+    def estimate(self, packages, limits):
+        """ Guess how long building packages would take, in seconds.
+
+        Packages we have never built are assumed to take the median time.
+        Each kind of stage can only run `limits[kind]` at once, so the
+        batch takes at least as long as the busiest kind needs.
+        """
+        per_kind = collections.defaultdict(
+            lambda: collections.defaultdict(float))
+        rows = self.db.execute(
+            "SELECT package, kind, stage, AVG(duration) FROM stages "
+            "WHERE status = 'ok' AND kind IS NOT NULL "
+            "GROUP BY package, kind, stage")
+        for package, kind, stage, duration in rows:
+            per_kind[kind][package] += duration
+
+        busiest = 0
+        for kind, totals in per_kind.items():
+            if not totals:
+                continue
+            median = shipit.utils.percentile(totals.values(), 0.5)
+            work = sum([totals.get(package, median) for package in packages])
+            busiest = max(busiest, work / limits.get(kind, 1))
+        return busiest
@@ -51,5 +51,6 @@ def log(msg):
     # We need to asynchronously update our logs while other inlineCallbacks
     # block are ongoing, so we do...
     d = shipit.utils.noop()
-    d.addCallback(lambda x: shipit.main.mainloop.draw_screen())
+    if shipit.main.mainloop is not None:
+        d.addCallback(lambda x: shipit.main.mainloop.draw_screen())
     return d
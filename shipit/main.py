@@ -18,13 +18,17 @@
 
 from __future__ import print_function
 
+import sys
+
 import shipit.config
 import shipit.consumers
 import shipit.controllers
+import shipit.daemon
 import shipit.log
 import shipit.model
 import shipit.producers
 import shipit.reactor
+import shipit.report
 import shipit.ui
 
 
@@ -39,6 +43,7 @@ def command():
     """
     global mainloop
     config, fedmsg_config = shipit.config.load_config()
+    daemon = '--daemon' in sys.argv[1:]
 
 
     shipit.log.initialize(config, fedmsg_config)
@@ -48,15 +53,37 @@ def command():
     shipit.utils.patch_webbrowser()
 
     shipit.utils.initialize_http(config, fedmsg_config)
+    shipit.utils.initialize_executor(config, fedmsg_config)
+
+    if sys.argv[1:2] == ['report']:
+        sys.exit(shipit.report.command(config, fedmsg_config, sys.argv[2:]))
 
     model = shipit.model.assemble_model(config, fedmsg_config)
 
+    if daemon:
+        shipit.reactor.initialize_daemon(config, fedmsg_config, model)
+        shipit.reactor.reactor.run()
+        return
+
+    # If someone is running a daemon, use its data instead of fetching our
+    # own and subscribing to the bus ourselves, but only if it is watching
+    # the same packagers we would.  Otherwise we'd be shown someone else's
+    # packages.
+    served = shipit.daemon.packagers(config['daemon.socket'])
+    attach = served is not None and \
+        sorted(served) == sorted(model.packagers())
+    if served is not None and not attach:
+        shipit.log.log('The shipit daemon serves packages of %s, not %s; '
+                       'loading our own' % (
+                           ', '.join(served), ', '.join(model.packagers())))
+
     ui, palette = shipit.ui.assemble_ui(config, fedmsg_config, model)
 
     controller = shipit.controllers.assemble_controller(
         config, fedmsg_config, ui, palette, model)
 
     mainloop = shipit.reactor.initialize(
-        config, fedmsg_config, ui, palette, model, controller)
+        config, fedmsg_config, ui, palette, model, controller,
+        attach=attach)
 
     mainloop.run()
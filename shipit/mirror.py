@@ -0,0 +1,172 @@
+# This file is part of shipit, a curses-based, fedmsg-aware heads up display
+# for Fedora package maintainers.
+# Copyright (C) 2014  Ralph Bean <rbean@redhat.com>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import collections
+import os
+import shutil
+import time
+
+import twisted.internet.defer
+import twisted.internet.threads
+
+from shipit.log import log
+from shipit.utils import run
+
+
+def disk_usage(path):
+    """ Total size in bytes of everything under path.  Blocking. """
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class MirrorCache(object):
+    """ Local bare mirrors of dist-git, one per package.
+
+    Instead of cloning the full history for every build, we keep a mirror
+    around, bring it up to date with an incremental fetch and hand out cheap
+    worktrees from it.  Mirrors are evicted least-recently-used first when
+    the cache grows past its size limit.
+    """
+
+    def __init__(self, config):
+        self.root = config['mirror_dir']
+        self.max_size = config['mirror.max_size']
+        self.git_url = config['dist_git_url']
+
+        # Only one clone/fetch per mirror at a time.
+        self.locks = collections.defaultdict(
+            twisted.internet.defer.DeferredLock)
+        # Known disk usage of each mirror, so eviction needn't walk them all.
+        self.sizes = {}
+        # When each mirror was last fetched.  Builds of several branches of
+        # one package at once only need to fetch once.
+        self.fresh = config['mirror.fresh']
+        self.fetched = {}
+        # Bytes brought in by the last update of each mirror.
+        self.transferred = {}
+
+    def __repr__(self):
+        return "<MirrorCache %r>" % self.root
+
+    def path_for(self, package):
+        return os.path.join(self.root, package + '.git')
+
+    @twisted.internet.defer.inlineCallbacks
+    def update(self, package):
+        """ Create or refresh the mirror for a package. """
+        path = self.path_for(package)
+        lock = self.locks[package]
+        yield lock.acquire()
+        try:
+            age = time.time() - self.fetched.get(package, 0)
+            if os.path.exists(path) and age < self.fresh:
+                self.transferred[package] = 0
+                yield twisted.internet.defer.returnValue(path)
+            elif os.path.exists(path):
+                before = self.sizes.get(package)
+                if before is None:
+                    before = yield twisted.internet.threads.deferToThread(
+                        disk_usage, path)
+                yield run(['git', 'fetch', '--prune', 'origin'], cwd=path)
+            else:
+                before = 0
+                if not os.path.isdir(self.root):
+                    os.makedirs(self.root)
+                url = self.git_url.format(package=package)
+                yield run(['git', 'clone', '--mirror', url, path])
+
+            after = self.sizes[package] = \
+                yield twisted.internet.threads.deferToThread(disk_usage, path)
+            self.transferred[package] = max(after - before, 0)
+            yield log('Fetched %i bytes into mirror of %r' % (
+                self.transferred[package], package))
+
+            # Mark it as recently used, for eviction.
+            os.utime(path, None)
+            self.fetched[package] = time.time()
+        finally:
+            lock.release()
+
+        yield self.evict()
+        yield twisted.internet.defer.returnValue(path)
+
+    def checkout(self, package, dest, ref='master'):
+        """ Check out ref of a package into dest as a detached worktree.
+
+        dest may be an existing empty directory.  Call update first.
+        """
+        return run(['git', 'worktree', 'add', '--detach', dest, ref],
+                   cwd=self.path_for(package))
+
+    @twisted.internet.defer.inlineCallbacks
+    def rev_parse(self, package, rev):
+        """ Return the object id of rev (like master:foo.spec) in a mirror.
+        """
+        output = yield run(['git', 'rev-parse', rev],
+                           cwd=self.path_for(package))
+        yield twisted.internet.defer.returnValue(output.strip())
+
+    @twisted.internet.defer.inlineCallbacks
+    def release(self, package, dest):
+        """ Throw away a worktree handed out by checkout. """
+        shutil.rmtree(dest, ignore_errors=True)
+        yield run(['git', 'worktree', 'prune'], cwd=self.path_for(package))
+
+    @twisted.internet.defer.inlineCallbacks
+    def evict(self):
+        """ Remove least recently used mirrors until we fit in max_size.
+
+        Mirrors with worktrees still checked out, or which are being updated,
+        are left alone.
+        """
+        if not os.path.isdir(self.root):
+            return
+
+        mirrors = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            package = name[:-len('.git')]
+            if package not in self.sizes:
+                self.sizes[package] = \
+                    yield twisted.internet.threads.deferToThread(
+                        disk_usage, path)
+            mirrors.append(
+                (os.path.getmtime(path), self.sizes[package], name, path))
+
+        total = sum([size for mtime, size, name, path in mirrors])
+        for mtime, size, name, path in sorted(mirrors):
+            if total <= self.max_size:
+                break
+            package = name[:-len('.git')]
+            if self.locks[package].locked:
+                continue
+            worktrees = os.path.join(path, 'worktrees')
+            if os.path.isdir(worktrees) and os.listdir(worktrees):
+                continue
+            yield log('Evicting mirror of %r (%i bytes)' % (package, size))
+            shutil.rmtree(path, ignore_errors=True)
+            self.sizes.pop(package, None)
+            total -= size
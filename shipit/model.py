@@ -19,13 +19,24 @@
 from __future__ import print_function
 
 import collections
+import json
+import os
 import time
 
 import twisted.internet.defer
 
+import shipit.backends
+import shipit.buildsys
+import shipit.history
+import shipit.mirror
+import shipit.pipeline
+import shipit.sources
+import shipit.store
+import shipit.workspace
 import shipit.reactor
 import shipit.signals
 import shipit.utils
+import shipit.version
 from shipit.log import log
 
 
@@ -34,24 +45,159 @@ def assemble_model(config, fedmsg_config):
 
 
 class Package(shipit.signals.AsyncNotifier):
-    def __init__(self, pkgdb, *args, **kwargs):
+    def __init__(self, pkgdb, index=None, owner=None, *args, **kwargs):
         self.name = pkgdb['name']
         self.pkgdb = pkgdb
+        # Whose package list this came from.
+        self.owner = owner
+        # When we last heard from anitya about it.
+        self.last_checked = None
         self.rawhide = None
         self.upstream = None
+        self.build = None
+        self.stage = None
+        self._classification = None
+        # See update_status.  The index (our PackageList) is told whenever
+        # the status changes.
+        self.index = index
+        self.comparison = None
+        self.status = None
         super(Package, self).__init__(*args, **kwargs)
 
     def __repr__(self):
         return "<Package %r>" % self.name
 
-    def set_upstream(self, upstream):
+    @property
+    def classification(self):
+        """ Anitya backend and upstream name guessed from the pkgdb url.
+        """
+        if self._classification is None:
+            self._classification = shipit.backends.classify(
+                self.name, self.pkgdb.get('upstream_url'))
+        return self._classification
+
+    @property
+    def backend(self):
+        return self.classification.backend
+
+    def set_upstream(self, upstream, last_checked=None):
+        """ Take new data from anitya, fetched just now unless last_checked
+        says otherwise, as when it is restored from a past session.
+        """
         self.upstream = upstream
+        if last_checked is None:
+            last_checked = time.time()
+        self.last_checked = last_checked
+        self.update_status()
         self.signal('upstream', upstream)
 
     def set_rawhide(self, rawhide):
         self.rawhide = rawhide
+        self.update_status()
         self.signal('rawhide', rawhide)
 
+    def update_status(self):
+        """ Work out how we stand against upstream.
+
+        The status is 'outdated' or 'ahead' if rawhide is behind or ahead of
+        upstream, 'missing' if anitya has no record of the package and
+        'unchecked' if anitya has never found a version for it.  Otherwise
+        it is None.
+        """
+        comparison, status = None, None
+        if self.upstream is None:
+            pass
+        elif 'version' not in self.upstream:
+            status = 'missing'
+        elif not self.upstream['version']:
+            status = 'unchecked'
+        elif self.rawhide:
+            comparison = shipit.version.compare(
+                self.rawhide[0], self.upstream['version'])
+            status = {-1: 'outdated', 0: None, 1: 'ahead'}[comparison]
+
+        self.comparison = comparison
+        if status != self.status:
+            old, self.status = self.status, status
+            if self.index is not None:
+                self.index.reindex(self, old)
+            self.signal('status', status)
+        if self.index is not None:
+            self.index.changed(self)
+
+    def set_build(self, task):
+        self.build = task
+        self.signal('build', task)
+
+    def set_stage(self, stage):
+        """ Show how far along the build pipeline this package is. """
+        self.stage = stage
+        self.signal('stage', stage)
+
+
+# Where a package stands against upstream.  See Package.update_status.
+statuses = ['outdated', 'ahead', 'missing', 'unchecked']
+
+# These are in the same order as koji.TASK_STATES
+task_states = ['FREE', 'OPEN', 'CLOSED', 'CANCELED', 'ASSIGNED', 'FAILED']
+finished_task_states = ['CLOSED', 'CANCELED', 'FAILED']
+
+
+class Task(object):
+    """ A koji task that we kicked off for one of our packages. """
+    def __init__(self, task_id, package, branch):
+        self.task_id = task_id
+        self.package = package
+        self.branch = branch
+        self.state = 'FREE'
+
+    def __repr__(self):
+        return "<Task %r %s/%s %s>" % (
+            self.task_id, self.package, self.branch, self.state)
+
+    @property
+    def finished(self):
+        return self.state in finished_task_states
+
+
+class TaskList(shipit.signals.AsyncNotifier, dict):
+    """ All the koji tasks we are watching, indexed by task_id.
+
+    buildsys.task.state.change messages for the whole of koji flow through
+    here, so the lookup must stay a plain dict access.  Interested parties
+    register for the 'state' signal keyed by package name, or for
+    'finished', which fires once per task however we heard it finished.
+    """
+
+    def __repr__(self):
+        return "<TaskList>"
+
+    def add(self, task_id, package, branch):
+        task = self[task_id] = Task(task_id, package, branch)
+        self.signal('state', package, task)
+        return task
+
+    def update(self, task_id, state):
+        """ Record a new state for a task.  Returns None if we don't care
+        about this task_id.
+        """
+        task = self.get(task_id)
+        if task is None:
+            return None
+
+        if isinstance(state, int):
+            state = task_states[state]
+
+        if task.state != state:
+            task.state = state
+            self.signal('state', task.package, task)
+            if task.finished:
+                self.signal('finished', task)
+        return task
+
+    def unfinished(self):
+        return [task for task in self.values() if not task.finished]
+
 
 class PackageList(shipit.signals.AsyncNotifier, collections.OrderedDict):
     """ Primary DB object.
@@ -66,12 +212,153 @@ class PackageList(shipit.signals.AsyncNotifier, collections.OrderedDict):
         self.anitya_url = config['anitya_url']
         self.pkgdb_url = config['pkgdb_url']
         self.username = config['username']
+        self.pkgdb_users = config['pkgdb.users']
+        self.pkgdb_groups = config['pkgdb.groups']
+        self.pkgdb_roles = config['pkgdb.roles']
+        self.pkgdb_concurrency = config['pkgdb.concurrency']
+        self.snapshot_file = config['snapshot']
+        self.snapshot = self.load_snapshot()
+
+        self.history = shipit.history.History(config)
+        self.buildsys = shipit.buildsys.Buildsys(config)
+        self.buildsys.history = self.history
+        self.mirrors = shipit.mirror.MirrorCache(config)
+        self.sources = shipit.sources.SourceCache(config)
+        self.memo = shipit.pipeline.Memo(
+            config['memo_file'], config['pipeline.memo_age'])
+        self.workspaces = shipit.workspace.WorkspacePool(config)
+        self.tasks = TaskList()
+
+        # Names of packages by status, kept up to date as data comes in so
+        # that filters and counts needn't look at every package.
+        self.statuses = dict([
+            (status, set()) for status in statuses
+        ])
+
+        # Optionally, everything is also written to a database which can be
+        # queried by owner, backend, status and so on.  What it held last
+        # time fills in for anything missing from the snapshot.
+        self.store, self.stored = None, {}
+        if config['store_file']:
+            self.store = shipit.store.Store(config['store_file'])
+            self.stored = self.store.load()
+        self.dirty = set()
+        self.flushing = None
+        # (packager, page) for every pkgdb page we couldn't load, and names
+        # of packages anitya wouldn't tell us about at startup.
+        self.load_failures = []
+        self.upstream_failures = []
 
         super(PackageList, self).__init__(*args, **kwargs)
 
     def __repr__(self):
         return "<PackageList>"
 
+    def add_package(self, pkgdb, owner=None):
+        """ Start tracking a package from pkgdb. """
+        name = pkgdb['name']
+        package = self[name] = Package(
+            pkgdb=pkgdb, index=self, owner=owner or self.username)
+        self.register('rawhide', name, package.set_rawhide)
+        self.tasks.register('state', name, package.set_build)
+        if name in self.nvr_dict:
+            package.set_rawhide(self.nvr_dict.get(name))
+        self.changed(package)
+        return package
+
+    def changed(self, package):
+        """ Note that a package needs writing to the store. """
+        if self.store is None:
+            return
+        self.dirty.add(package.name)
+        if self.flushing is None:
+            self.flushing = shipit.reactor.reactor.callLater(1, self.flush)
+
+    def flush(self):
+        """ Write every package changed since the last flush. """
+        if self.flushing is not None and self.flushing.active():
+            self.flushing.cancel()
+        self.flushing = None
+        if self.store is None or not self.dirty:
+            return
+        self.store.save([self[name] for name in self.dirty if name in self])
+        self.dirty.clear()
+
+    def select(self, **where):
+        """ Names of packages with the given attributes, like owner='foo'.
+        """
+        if self.store is not None:
+            self.flush()
+            return self.store.select(**where)
+        return set([
+            name for name, package in self.items()
+            if all([getattr(package, attr) == value
+                    for attr, value in where.items()])
+        ])
+
+    def order(self, attr, descending=False):
+        """ Names of all packages sorted by an attribute. """
+        if self.store is not None:
+            self.flush()
+            return self.store.order(attr, descending)
+        # Unset values first, as SQLite does.
+        key = lambda package: (getattr(package, attr) is not None,
+                               getattr(package, attr), package.name)
+        return [package.name for package in
+                sorted(self.values(), key=key, reverse=descending)]
+
+    def reindex(self, package, old):
+        """ Move a package whose status changed from old to the new one.
+        """
+        if old is not None:
+            self.statuses[old].discard(package.name)
+        if package.status is not None:
+            self.statuses[package.status].add(package.name)
+        self.signal('summary', self.summary())
+
+    def summary(self):
+        return '   '.join([
+            '%s: %i' % (status, len(self.statuses[status]))
+            for status in statuses
+        ])
+
+    def load_snapshot(self):
+        """ Load upstream data saved at the end of the last session.
+
+        Returns an empty dict if there is no usable snapshot on disk.
+        """
+        if not os.path.exists(self.snapshot_file):
+            return {}
+        try:
+            with open(self.snapshot_file, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            return {}
+
+    def save_snapshot(self):
+        """ Write our upstream data to disk so the next session can skip
+        refetching it and just replay the messages it missed.
+        """
+        self.flush()
+        snapshot = dict(
+            timestamp=time.time(),
+            upstream=dict([
+                (name, package.upstream) for name, package in self.items()
+                if package.upstream is not None
+            ]),
+            checked=dict([
+                (name, package.last_checked)
+                for name, package in self.items()
+                if package.last_checked is not None
+            ]),
+        )
+        with open(self.snapshot_file, 'w') as f:
+            json.dump(snapshot, f)
+
+    def start_polling(self):
+        """ Check on koji tasks in case fedmsg is quiet about them. """
+        self.buildsys.start_polling(self.tasks)
+
     @twisted.internet.defer.inlineCallbacks
     def build_nvr_dict(self):
 
@@ -101,36 +388,50 @@ class PackageList(shipit.signals.AsyncNotifier, collections.OrderedDict):
 
         yield log("Done building nvr dict with %i items" % len(self.nvr_dict))
 
+    def packagers(self):
+        """ Everyone whose packages we show.  pkgdb calls groups group::foo.
+        """
+        return (self.pkgdb_users or [self.username]) + [
+            'group::' + group for group in self.pkgdb_groups
+        ]
+
     @twisted.internet.defer.inlineCallbacks
     def load_pkgdb_packages(self):
-        url = self.pkgdb_url + '/api/packager/package/' + self.username
-        yield log('Loading packages from ' + url)
         start = time.time()
 
-        resp = yield shipit.utils.http.get(url)
-        pkgdb = resp.json()
-
-        for package in pkgdb['point of contact']:
-            name = package['name']
-            package = self[name] = Package(pkgdb=package)
-            self.register('rawhide', name, package.set_rawhide)
-            if name in self.nvr_dict:
-                yield package.set_rawhide(self.nvr_dict.get(name))
-
-        self.signal('pkgdb', self.items())
+        # Pages for every packager are fetched at once, a few at a time, and
+        # their packages are shown as soon as each page arrives.
+        semaphore = twisted.internet.defer.DeferredSemaphore(
+            self.pkgdb_concurrency)
+        deferreds = []
+        yield twisted.internet.defer.DeferredList([
+            self.load_packager(packager, semaphore, deferreds)
+            for packager in self.packagers()
+        ])
+        if self.store is not None:
+            self.store.prune(self.keys())
 
         delta = time.time() - start
 
         yield log('Found %i packages in %is' % (len(self), delta))
 
-        deferreds = []
-        for name in self:
-            url = self.anitya_url + '/api/project/Fedora/' + name
-            deferreds.append(shipit.utils.http.get(url))
-
-        for d, name, package in zip(deferreds, *zip(*self.items())):
-            response = yield d
-            project = response.json()
+        if self.snapshot.get('upstream') or self.store is not None:
+            yield log('Restored %i upstream projects from last session, '
+                      'fetching %i' % (len(self) - len(deferreds),
+                                       len(deferreds)))
+
+        # One package anitya won't tell us about mustn't keep everything
+        # waiting on 'initialized' (the refresher, catch-up, clients) from
+        # ever starting.
+        for package, d in deferreds:
+            try:
+                response = yield d
+                project = response.json()
+            except Exception as e:
+                yield log('Could not get %r from anitya: %r' % (
+                    package.name, e))
+                self.upstream_failures.append(package.name)
+                continue
 
             yield package.set_upstream(project)
 
@@ -139,6 +440,80 @@ class PackageList(shipit.signals.AsyncNotifier, collections.OrderedDict):
         delta = time.time() - start
         yield log('Done loading data in %is' % delta)
 
+    @twisted.internet.defer.inlineCallbacks
+    def load_packager(self, packager, semaphore, deferreds, throttle=None):
+        """ Load every page of one packager's packages. """
+        first = yield semaphore.run(
+            self.load_page, packager, 1, deferreds, throttle)
+        yield twisted.internet.defer.DeferredList([
+            semaphore.run(self.load_page, packager, page, deferreds, throttle)
+            for page in range(2, first.get('page_total', 1) + 1)
+        ])
+
+    @twisted.internet.defer.inlineCallbacks
+    def load_page(self, packager, page, deferreds, throttle=None):
+        """ Add the packages on one page we haven't seen yet.
+
+        Requests for their upstream data are appended to deferreds.  If
+        given, throttle is called before each request to pkgdb or anitya
+        and returns a Deferred to wait on.
+        """
+        url = '%s/api/packager/package/%s' % (self.pkgdb_url, packager)
+        yield log('Loading page %i of packages from %s' % (page, url))
+        try:
+            if throttle is not None:
+                yield throttle()
+            resp = yield shipit.utils.http.get(url, params=dict(page=page))
+            pkgdb = resp.json()
+        except Exception as e:
+            yield log('Could not load %s page %i: %r' % (url, page, e))
+            self.load_failures.append((packager, page))
+            yield twisted.internet.defer.returnValue({})
+
+        added = []
+        for role in self.pkgdb_roles:
+            for package in pkgdb.get(role, []):
+                if package['name'] not in self:
+                    added.append(self.add_package(package, owner=packager))
+
+        if added:
+            self.signal('pkgdb', [
+                (package.name, package) for package in added])
+        self.fetch_upstreams(added, deferreds, throttle)
+        yield twisted.internet.defer.returnValue(pkgdb)
+
+    def fetch_upstreams(self, packages, deferreds, throttle=None):
+        """ Ask anitya about packages, appending (package, Deferred) pairs
+        to deferreds.
+        """
+        # Anything we saved last time is brought up to date by replaying the
+        # bus history (see shipit.consumers.catch_up), so we only need to ask
+        # anitya about packages we have never seen before.
+        snapshot = self.snapshot.get('upstream', {})
+        checked = self.snapshot.get('checked', {})
+
+        for package in packages:
+            stored = self.stored.pop(package.name, None)
+            # When anitya was last asked, or 0 if we don't know.
+            last_checked = checked.get(package.name) or \
+                (stored and stored[1]) or 0
+            if package.name in snapshot:
+                package.set_upstream(snapshot[package.name], last_checked)
+            elif stored is not None:
+                package.set_upstream(stored[0], last_checked)
+            else:
+                deferreds.append((
+                    package, self.fetch_upstream(package.name, throttle)))
+
+    @twisted.internet.defer.inlineCallbacks
+    def fetch_upstream(self, name, throttle=None):
+        """ Fires with anitya's response about one package. """
+        if throttle is not None:
+            yield throttle()
+        url = self.anitya_url + '/api/project/Fedora/' + name
+        response = yield shipit.utils.http.get(url)
+        yield twisted.internet.defer.returnValue(response)
+
     @twisted.internet.defer.inlineCallbacks
     def fake_load_pkgdb_packages(self):
 
@@ -166,11 +541,7 @@ class PackageList(shipit.signals.AsyncNotifier, collections.OrderedDict):
         }
 
         for package in fake_packages:
-            name = package['name']
-            package = self[name] = Package(pkgdb=package)
-            self.register('rawhide', name, package.set_rawhide)
-            if name in self.nvr_dict:
-                yield package.set_rawhide(self.nvr_dict.get(name))
+            self.add_package(package)
 
         self.signal('pkgdb', self.items())
 
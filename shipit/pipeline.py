@@ -0,0 +1,292 @@
+# This file is part of shipit, a curses-based, fedmsg-aware heads up display
+# for Fedora package maintainers.
+# Copyright (C) 2014  Ralph Bean <rbean@redhat.com>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import collections
+import hashlib
+import json
+import os
+import time
+import traceback
+
+import twisted.internet.defer
+
+from shipit.log import log
+
+
+kinds = ['network', 'cpu', 'koji']
+
+
+class Stage(object):
+    """ One step of the build, with the steps it depends on.
+
+    Stages that declare `inputs` are memoized: their `outputs` (attributes
+    they set on the job) are remembered under a hash of their input
+    attributes, and the next time the inputs are the same the stage and
+    everything it requires is skipped.  `valid`, if given, is called with
+    the remembered outputs to check they are still usable, and may return a
+    Deferred.
+    """
+    def __init__(self, name, kind, fn, requires=(), inputs=(), outputs=(),
+                 valid=None):
+        self.name = name
+        self.kind = kind
+        self.fn = fn
+        self.requires = requires
+        self.inputs = inputs
+        self.outputs = outputs
+        self.valid = valid
+
+    def __repr__(self):
+        return "<Stage %s (%s)>" % (self.name, self.kind)
+
+
+class Job(object):
+    """ Scratch space for one package as it moves through the stages. """
+    def __init__(self, package, **kwargs):
+        self.package = package
+        self.name = package.name
+        self.result = None
+        self.failed = None
+        self.skipped = []
+        # How much each stage downloaded or uploaded, by stage name.  Kept
+        # apart since a job's stages may run side by side.
+        self.bytes = {}
+        # Put in front of the stage shown for the package, to tell apart
+        # several jobs for the same package.
+        self.prefix = ''
+        # Called once the job is done, whether it failed or not.
+        self.cleanups = []
+        self.__dict__.update(kwargs)
+
+    def __repr__(self):
+        return "<Job %r>" % (self.prefix + self.name)
+
+    def status(self, text):
+        self.package.set_stage(self.prefix + text)
+
+
+class Memo(object):
+    """ Outputs of completed stages, kept on disk between sessions.
+
+    Entries older than `max_age` seconds are dropped as the file is loaded,
+    so it doesn't grow forever.
+    """
+    def __init__(self, filename, max_age):
+        self.filename = filename
+        self.max_age = max_age
+        self.entries = self.load()
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return {}
+        try:
+            with open(self.filename, 'r') as f:
+                entries = json.load(f)
+        except ValueError:
+            return {}
+        cutoff = time.time() - self.max_age
+        return dict([
+            (key, entry) for key, entry in entries.items()
+            if 'outputs' in entry and entry.get('time', 0) > cutoff
+        ])
+
+    def save(self):
+        directory = os.path.dirname(self.filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.filename, 'w') as f:
+            json.dump(self.entries, f)
+
+    @staticmethod
+    def key(stage, job):
+        inputs = [(attr, getattr(job, attr)) for attr in stage.inputs]
+        blob = json.dumps([stage.name, job.name, inputs], sort_keys=True)
+        return hashlib.sha1(blob).hexdigest()
+
+    def get(self, stage, job):
+        entry = self.entries.get(self.key(stage, job))
+        return entry and entry['outputs']
+
+    def put(self, stage, job):
+        outputs = dict([(attr, getattr(job, attr)) for attr in stage.outputs])
+        self.entries[self.key(stage, job)] = dict(
+            time=time.time(), outputs=outputs)
+        self.save()
+
+
+class Pipeline(object):
+    """ Run a graph of stages over many packages at once.
+
+    Each stage is a function taking a job and returning a Deferred.  A stage
+    runs once everything it requires has finished, so independent stages of
+    one package run side by side, and every package runs at once.  Stages
+    are tagged with a kind ('network', 'cpu', 'koji') and each kind has its
+    own limit on how many may be running at once, so one package can be
+    cloning while another builds its SRPM and a third uploads to koji.
+    Stages of kind None are not limited.
+    """
+    def __init__(self, config, stages, memo, history=None):
+        self.history = history
+        self.stages = collections.OrderedDict([
+            (stage.name, stage) for stage in stages
+        ])
+        self.memo = memo
+        # Memoized stages currently running, by memo key.  Another job with
+        # the same key waits for these instead of doing the work again.
+        self.inflight = {}
+        self.limits = dict([
+            (kind, twisted.internet.defer.DeferredSemaphore(
+                config['pipeline.%s_jobs' % kind]))
+            for kind in kinds
+        ])
+
+    def producers(self, stage):
+        """ Names of the stages that set the attributes stage is keyed on. """
+        return [
+            other.name for other in self.stages.values()
+            if set(other.outputs) & set(stage.inputs)
+        ]
+
+    @twisted.internet.defer.inlineCallbacks
+    def run_stage(self, job, name, running):
+        """ Run a stage of a job, after whatever it needs.
+
+        `running` maps stage names to Deferreds for this job, so each stage
+        runs at most once however many others require it.  Progress is shown
+        with Package.set_stage: '(name)' while waiting for a slot, 'name'
+        while running and '!name' if it failed.
+        """
+        stage = self.stages[name]
+
+        key = None
+        if stage.inputs:
+            yield self.run_stages(job, self.producers(stage), running)
+            key = self.memo.key(stage, job)
+            while key in self.inflight:
+                job.status('(%s)' % name)
+                try:
+                    yield self.inflight[key]
+                except Exception:
+                    pass
+            outputs = self.memo.get(stage, job)
+            if outputs is not None and stage.valid is not None:
+                valid = yield twisted.internet.defer.maybeDeferred(
+                    stage.valid, outputs)
+                if not valid:
+                    outputs = None
+            if outputs is not None:
+                job.__dict__.update(outputs)
+                job.skipped.append(name)
+                yield twisted.internet.defer.returnValue(None)
+            self.inflight[key] = twisted.internet.defer.Deferred()
+
+        try:
+            yield self.run_stages(job, stage.requires, running)
+
+            job.status('(%s)' % name)
+            limit = self.limits.get(stage.kind)
+            if limit:
+                yield limit.acquire()
+            start, status = time.time(), 'failed'
+            try:
+                job.status(name)
+                job.result = yield stage.fn(job)
+                status = 'ok'
+            except Exception:
+                job.failed = job.failed or name
+                job.status('!' + name)
+                yield log('%r failed in %s' % (job, name))
+                for line in traceback.format_exc().strip().split('\n'):
+                    yield log(line)
+                raise
+            finally:
+                if limit:
+                    limit.release()
+                if self.history:
+                    self.history.record(
+                        job.name, getattr(job, 'branch', None), name,
+                        stage.kind, time.time() - start,
+                        job.bytes.get(name, 0), status)
+
+            if key:
+                self.memo.put(stage, job)
+        finally:
+            if key:
+                self.inflight.pop(key).callback(None)
+
+    @twisted.internet.defer.inlineCallbacks
+    def run_stages(self, job, names, running):
+        """ Run stages of a job, failing if any of them failed. """
+        for name in names:
+            if name not in running:
+                # A failure is kept as the result, wrapped in a list, since
+                # once one waiter has handled it the others would see None.
+                running[name] = self.run_stage(
+                    job, name, running).addErrback(lambda failure: [failure])
+        outcomes = yield twisted.internet.defer.gatherResults(
+            [running[name] for name in names])
+        for outcome in outcomes:
+            if outcome is not None:
+                outcome[0].raiseException()
+
+    @twisted.internet.defer.inlineCallbacks
+    def run_job(self, job, targets):
+        try:
+            yield self.run_stages(job, targets, {})
+        except Exception:
+            # Already logged by run_stage
+            pass
+        finally:
+            for cleanup in reversed(job.cleanups):
+                try:
+                    yield cleanup()
+                except Exception as e:
+                    yield log('Cleanup for %r failed: %r' % (job, e))
+
+        if job.skipped:
+            yield log('%r: %s already done' % (
+                job, ', '.join(job.skipped)))
+            if not job.failed and set(targets) <= set(job.skipped):
+                job.status('cached')
+        yield twisted.internet.defer.returnValue(job)
+
+    @twisted.internet.defer.inlineCallbacks
+    def run(self, jobs, targets=None):
+        """ Run all the jobs.  Fires with the list of jobs once all are done.
+
+        Only the target stages, and whatever they need, are run.  By default
+        that is the last stage.  A failure in one job doesn't stop the others.
+        """
+        targets = targets or [list(self.stages)[-1]]
+        jobs = yield twisted.internet.defer.gatherResults([
+            self.run_job(job, targets) for job in jobs
+        ])
+
+        failed = collections.OrderedDict([
+            (job.prefix + job.name, job.failed) for job in jobs if job.failed
+        ])
+        yield log('Pipeline done: %i succeeded, %i failed' % (
+            len(jobs) - len(failed), len(failed)))
+        if failed:
+            yield log('Failures: ' + ', '.join([
+                '%s (%s)' % item for item in failed.items()
+            ]))
+
+        yield twisted.internet.defer.returnValue(jobs)
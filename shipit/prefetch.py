@@ -0,0 +1,229 @@
+# This file is part of shipit, a curses-based, fedmsg-aware heads up display
+# for Fedora package maintainers.
+# Copyright (C) 2014  Ralph Bean <rbean@redhat.com>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import time
+
+import twisted.internet.defer
+import twisted.python.failure
+
+import shipit.reactor
+import shipit.utils
+from shipit.log import log
+
+
+class Prefetcher(object):
+    """ Fetches the details of packages near the cursor before we need them.
+
+    Anitya mappings, recent koji builds and open bugs are too expensive to
+    get for every row.  Once the cursor has rested on a row for
+    prefetch.delay seconds, they are fetched for it and the
+    prefetch.neighbours rows either side, a few at a time.  Results are
+    kept for prefetch.ttl seconds.  Prefetches for rows the cursor has
+    since left are dropped if they are still waiting, or stop before their
+    next request if not; requests already sent are not aborted.
+    """
+
+    def __init__(self, config, model):
+        self.model = model
+        self.anitya_url = config['anitya_url']
+        self.bugzilla_url = config['bugzilla_url']
+        self.ttl = config['prefetch.ttl']
+        self.delay = config['prefetch.delay']
+        self.neighbours = config['prefetch.neighbours']
+        self.semaphore = twisted.internet.defer.DeferredSemaphore(
+            config['prefetch.concurrency'])
+
+        # Details by package name, as (when fetched, details).
+        self.cache = {}
+        # Names near the cursor, and the prefetches running or waiting.
+        self.wanted = set()
+        self.inflight = {}
+        self.timer = None
+
+    def __repr__(self):
+        return "<Prefetcher %i cached>" % len(self.cache)
+
+    def focus_changed(self, listbox):
+        """ Wait for the cursor to settle before doing anything. """
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = shipit.reactor.reactor.callLater(
+            self.delay, self.settle, listbox)
+
+    def settle(self, listbox):
+        self.timer = None
+        widget, position = listbox.get_focus()
+        if position is None:
+            return
+
+        # Nearest first, so the row under the cursor comes first.
+        rows = listbox.reference
+        start = max(0, position - self.neighbours)
+        nearby = sorted(
+            range(start, min(len(rows), position + self.neighbours + 1)),
+            key=lambda i: abs(i - position))
+        packages = [
+            rows[i].package for i in nearby if hasattr(rows[i], 'package')
+        ]
+
+        self.wanted = set([package.name for package in packages])
+        for name, d in list(self.inflight.items()):
+            if name not in self.wanted:
+                d.cancel()
+
+        for package in packages:
+            if package.name in self.inflight or self.cached(package.name):
+                continue
+            d = self.semaphore.run(self.prefetch, package)
+            d.addErrback(self.failed, package.name)
+            self.inflight[package.name] = d
+
+    def failed(self, failure, name):
+        self.inflight.pop(name, None)
+        if not failure.check(twisted.internet.defer.CancelledError):
+            return log('Could not prefetch %r: %s' % (
+                name, failure.getErrorMessage()))
+
+    def cached(self, name):
+        """ Details for name, if we have some that are fresh enough. """
+        if name not in self.cache:
+            return None
+        fetched, details = self.cache[name]
+        if time.time() - fetched > self.ttl:
+            del self.cache[name]
+            return None
+        return details
+
+    def remember(self, name, details):
+        """ Cache details for name, forgetting anything gone stale. """
+        now = time.time()
+        for other, (fetched, _) in list(self.cache.items()):
+            if now - fetched > self.ttl:
+                del self.cache[other]
+        self.cache[name] = (now, details)
+
+    @twisted.internet.defer.inlineCallbacks
+    def prefetch(self, package):
+        details = None
+        try:
+            # The cursor may have moved on while we waited our turn.
+            if package.name in self.wanted:
+                details = yield self.fetch(package, prefetching=True)
+        finally:
+            self.inflight.pop(package.name, None)
+        yield twisted.internet.defer.returnValue(details)
+
+    def details(self, package):
+        """ Fires with a package's details, from the cache if possible.
+
+        If they are being prefetched, we wait for that rather than asking
+        for everything twice, and only fetch them ourselves should the
+        prefetch give up.
+        """
+        details = self.cached(package.name)
+        if details is not None:
+            return twisted.internet.defer.succeed(details)
+        if package.name not in self.inflight:
+            return self.fetch(package)
+
+        waiter = twisted.internet.defer.Deferred()
+
+        def relay(result):
+            waiter.callback(result if isinstance(result, dict) else None)
+            return result
+
+        self.inflight[package.name].addBoth(relay)
+        waiter.addCallback(
+            lambda details: details or self.fetch(package))
+        return waiter
+
+    @twisted.internet.defer.inlineCallbacks
+    def fetch(self, package, prefetching=False):
+        """ Fires with a package's details, fetched afresh.
+
+        When prefetching, the sources are asked one at a time, and we give
+        up (firing with None) as soon as the cursor has moved away from the
+        package.  A request already sent is left to finish, since we have
+        no way to abort it.  Otherwise they are all asked at once.
+        """
+        sources = [
+            ('mappings', self.fetch_mappings),
+            ('builds', self.fetch_builds),
+            ('bugs', self.fetch_bugs),
+        ]
+        if prefetching:
+            results = []
+            for key, fn in sources:
+                if package.name not in self.wanted:
+                    yield twisted.internet.defer.returnValue(None)
+                try:
+                    result = yield fn(package)
+                    results.append((True, result))
+                except twisted.internet.defer.CancelledError:
+                    # The cursor left; don't keep half the details.
+                    raise
+                except Exception:
+                    results.append((False, twisted.python.failure.Failure()))
+        else:
+            results = yield twisted.internet.defer.DeferredList([
+                fn(package) for key, fn in sources
+            ])
+
+        # One source failing shouldn't stop us showing the others.
+        details = {}
+        for (key, fn), (success, result) in zip(sources, results):
+            if success:
+                details[key] = result
+            else:
+                details[key] = None
+                yield log('Could not get %s for %r: %s' % (
+                    key, package.name, result.getErrorMessage()))
+
+        self.remember(package.name, details)
+        yield twisted.internet.defer.returnValue(details)
+
+    @twisted.internet.defer.inlineCallbacks
+    def fetch_mappings(self, package):
+        """ Which distros anitya maps this project to, and under what name.
+        """
+        idx = (package.upstream or {}).get('id')
+        if not idx:
+            yield twisted.internet.defer.returnValue([])
+        url = '%s/api/project/%i' % (self.anitya_url, idx)
+        resp = yield shipit.utils.http.get(url)
+        yield twisted.internet.defer.returnValue([
+            '%s/%s' % (mapping['distro'], mapping['package_name'])
+            for mapping in resp.json().get('packages', [])
+        ])
+
+    def fetch_builds(self, package):
+        return self.model.buildsys.recent_builds(package.name)
+
+    @twisted.internet.defer.inlineCallbacks
+    def fetch_bugs(self, package):
+        url = self.bugzilla_url + '/rest/bug'
+        params = dict(
+            product='Fedora',
+            component=package.name,
+            status=['NEW', 'ASSIGNED', 'ON_DEV', 'POST', 'MODIFIED'],
+            include_fields='id,summary,status',
+        )
+        resp = yield shipit.utils.http.get(url, params=params)
+        yield twisted.internet.defer.returnValue(resp.json().get('bugs', []))
@@ -27,14 +27,20 @@ from twisted.internet import reactor
 
 
 
-def initialize(config, fedmsg_config, ui, palette, model, controller):
+def start_services(config, fedmsg_config, model):
+    """ Subscribe to the bus and load everything into the model.
+
+    Returns a function to call at shutdown.
+    """
 
     import shipit.consumers
+    import shipit.log
     import shipit.producers
+    import shipit.refresh
 
     import shipit.utils
 
-    consumers = [lambda hub: cls(hub, model)
+    consumers = [lambda hub: cls(hub, config, model)
                  for cls in shipit.consumers.all_consumers]
     producers = [lambda hub: cls(hub, model)
                  for cls in shipit.producers.all_producers]
@@ -43,15 +49,82 @@ def initialize(config, fedmsg_config, ui, palette, model, controller):
     startup_routines = [
         model.build_nvr_dict,
         model.load_pkgdb_packages,
+        model.start_polling,
+        model.workspaces.start_reaper,
         #model.fake_load_pkgdb_packages,
     ]
     for routine in startup_routines:
         reactor.callWhenRunning(routine)
 
+    # If we have a snapshot from last time, replay whatever we missed from the
+    # bus once the package list is loaded.
+    since = model.snapshot.get('timestamp')
+    if since:
+        def catch_up(packages):
+            for consumer in hub.consumers:
+                if isinstance(consumer, shipit.consumers.ShipitConsumer):
+                    shipit.consumers.catch_up(config, consumer, since)
+        model.register('initialized', None, catch_up)
+
+    # In case the bus goes quiet on us.
+    refresher = shipit.refresh.Refresher(config, model)
+    model.register('initialized', None, refresher.start)
+
     def cleanup(*args, **kwargs):
+        refresher.stop()
+        for consumer in hub.consumers:
+            if isinstance(consumer, shipit.consumers.ShipitConsumer):
+                consumer.flush_all()
+        model.save_snapshot()
+        for consumer in hub.consumers:
+            if hasattr(consumer, 'stats_summary'):
+                shipit.log.log('fedmsg stats: ' + consumer.stats_summary())
         hub.close()
         shipit.utils.http.close()
 
+    return cleanup
+
+
+def attach_services(config, fedmsg_config, model):
+    """ Get packages from a shipit daemon, keeping only our own builds here.
+
+    Returns a function to call at shutdown.
+    """
+
+    import shipit.daemon
+    import shipit.utils
+
+    startup_routines = [
+        lambda: shipit.daemon.attach(config, model),
+        model.start_polling,
+        model.workspaces.start_reaper,
+    ]
+    for routine in startup_routines:
+        reactor.callWhenRunning(routine)
+
+    def cleanup(*args, **kwargs):
+        shipit.utils.http.close()
+
+    return cleanup
+
+
+def initialize_daemon(config, fedmsg_config, model):
+    """ Run headless, sharing our model with clients over a socket. """
+
+    import shipit.daemon
+
+    cleanup = start_services(config, fedmsg_config, model)
+    shipit.daemon.serve(config, model)
+    reactor.addSystemEventTrigger('before', 'shutdown', cleanup)
+
+
+def initialize(config, fedmsg_config, ui, palette, model, controller,
+               attach=False):
+    if attach:
+        cleanup = attach_services(config, fedmsg_config, model)
+    else:
+        cleanup = start_services(config, fedmsg_config, model)
+
     reactor.addSystemEventTrigger('before', 'shutdown', cleanup)
     result = urwid.MainLoop(
         ui, palette,
@@ -0,0 +1,203 @@
+# This file is part of shipit, a curses-based, fedmsg-aware heads up display
+# for Fedora package maintainers.
+# Copyright (C) 2014  Ralph Bean <rbean@redhat.com>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import heapq
+import random
+import time
+
+import twisted.internet.defer
+import twisted.internet.task
+
+import shipit.reactor
+import shipit.utils
+from shipit.log import log
+
+
+def sleep(seconds):
+    return twisted.internet.task.deferLater(
+        shipit.reactor.reactor, seconds, lambda: None)
+
+
+def jitter(seconds, spread=0.2):
+    return seconds * random.uniform(1 - spread, 1 + spread)
+
+
+class Refresher(object):
+    """ Re-checks pkgdb, rawhide and anitya in the background.
+
+    fedmsg should tell us about everything, but if we lose the bus we would
+    never know.  So every package's upstream data is fetched again now and
+    then: more often for packages that change often, less for dormant ones.
+    rawhide and pkgdb are reloaded on their own, slower, schedules.
+
+    Every request waits on a token bucket, so we never make more than
+    refresh.budget requests a minute however many packages there are.
+    """
+
+    def __init__(self, config, model):
+        self.model = model
+        self.anitya_url = config['anitya_url']
+        self.min_interval = config['refresh.min']
+        self.max_interval = config['refresh.max']
+        self.initial = config['refresh.initial']
+        self.rawhide_interval = config['refresh.rawhide']
+        self.pkgdb_interval = config['refresh.pkgdb']
+        budget = config['refresh.budget']
+        self.bucket = shipit.utils.TokenBucket(budget / 60.0, max(budget, 1))
+        self.enabled = budget > 0
+
+        # (when, name) for each package, soonest first.  Names of '' and
+        # None are the pkgdb and rawhide reloads.
+        self.queue = []
+        self.intervals = {}
+        self.versions = {}
+        self.running = False
+        self.missed = 0
+
+    def __repr__(self):
+        return "<Refresher %i queued>" % len(self.queue)
+
+    def start(self, packages=None):
+        if not self.enabled or self.running:
+            return
+        self.running = True
+        now = time.time()
+        for name, package in self.model.items():
+            self.watch(package)
+        heapq.heappush(self.queue, (now + jitter(self.rawhide_interval), None))
+        heapq.heappush(self.queue, (now + jitter(self.pkgdb_interval), ''))
+        self.model.register('pkgdb', None, self.added)
+        log('Refreshing %i packages in the background' % len(self.model))
+        self.loop()
+
+    def stop(self):
+        self.running = False
+
+    def added(self, packages):
+        for name, package in packages:
+            if name not in self.intervals:
+                self.watch(package)
+
+    def watch(self, package):
+        """ Schedule a package somewhere in its first interval, so they
+        don't all come due at once.
+        """
+        self.intervals[package.name] = self.initial
+        self.versions[package.name] = self.version(package)
+        package.register('upstream', None, self.changed(package))
+        heapq.heappush(self.queue, (
+            time.time() + random.uniform(0, self.initial), package.name))
+
+    def version(self, package):
+        return (package.upstream or {}).get('version')
+
+    def changed(self, package):
+        def callback(upstream):
+            self.moved(package.name, self.version(package))
+        return callback
+
+    def moved(self, name, version):
+        """ Note a package's upstream version, and if it moves, look at it
+        more often.
+        """
+        if version != self.versions.get(name):
+            self.versions[name] = version
+            self.intervals[name] = max(
+                self.min_interval, self.intervals[name] / 2)
+
+    def reschedule(self, name, interval):
+        heapq.heappush(self.queue, (time.time() + jitter(interval), name))
+
+    @twisted.internet.defer.inlineCallbacks
+    def loop(self):
+        while self.running:
+            if not self.queue:
+                yield sleep(60)
+                continue
+            when, name = self.queue[0]
+            if when > time.time():
+                yield sleep(min(when - time.time(), 60))
+                continue
+            heapq.heappop(self.queue)
+
+            yield self.bucket.take()
+            if name is None:
+                d = self.refresh_rawhide()
+            elif name == '':
+                d = self.refresh_pkgdb()
+            else:
+                d = self.refresh_package(name)
+            d.addErrback(lambda failure: log(
+                'Refresh of %r failed: %s' % (
+                    name, failure.getErrorMessage())))
+
+    @twisted.internet.defer.inlineCallbacks
+    def refresh_package(self, name):
+        package = self.model.get(name)
+        if package is None:
+            return
+        try:
+            url = self.anitya_url + '/api/project/Fedora/' + name
+            response = yield shipit.utils.http.get(url)
+            project = response.json()
+        except Exception:
+            self.reschedule(name, self.intervals[name])
+            raise
+
+        # Settle the new interval before rescheduling; the 'upstream'
+        # signal only reaches us later.
+        version = project.get('version')
+        if version != self.version(package):
+            self.missed += 1
+            yield log('Refresh found %r at %r; fedmsg missed %i so far' % (
+                name, version, self.missed))
+            self.moved(name, version)
+            package.set_upstream(project)
+        else:
+            # Quiet; look at it less often.
+            self.intervals[name] = min(
+                self.max_interval, self.intervals[name] * 1.5)
+        self.reschedule(name, self.intervals[name])
+
+    @twisted.internet.defer.inlineCallbacks
+    def refresh_rawhide(self):
+        try:
+            yield self.model.build_nvr_dict()
+        finally:
+            self.reschedule(None, self.rawhide_interval)
+
+    @twisted.internet.defer.inlineCallbacks
+    def refresh_pkgdb(self):
+        """ Pick up packages added to pkgdb since we started. """
+        try:
+            semaphore = twisted.internet.defer.DeferredSemaphore(1)
+            deferreds = []
+            for packager in self.model.packagers():
+                yield self.model.load_packager(
+                    packager, semaphore, deferreds, self.bucket.take)
+            for package, d in deferreds:
+                try:
+                    response = yield d
+                    package.set_upstream(response.json())
+                except Exception as e:
+                    yield log('Could not get %r from anitya: %r' % (
+                        package.name, e))
+        finally:
+            self.reschedule('', self.pkgdb_interval)
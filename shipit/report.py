@@ -0,0 +1,156 @@
+# This file is part of shipit, a curses-based, fedmsg-aware heads up display
+# for Fedora package maintainers.
+# Copyright (C) 2014  Ralph Bean <rbean@redhat.com>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import csv
+import json
+import sys
+
+import twisted.internet.defer
+
+import shipit.model
+import shipit.reactor
+import shipit.utils
+
+
+fields = [
+    'name', 'owner', 'backend', 'rawhide_version', 'rawhide_release',
+    'upstream_version', 'anitya_id', 'status',
+]
+
+
+class Reporter(object):
+    """ Writes out each package as soon as we know both its rawhide and its
+    upstream version.
+    """
+
+    def __init__(self, model, out, format='json'):
+        self.model = model
+        self.out = out
+        self.format = format
+        self.writer = None
+        if format == 'csv':
+            self.writer = csv.writer(out)
+            self.writer.writerow(fields)
+        self.emitted = set()
+        self.rawhide_loaded = False
+        model.register('pkgdb', None, self.watch)
+
+    def watch(self, packages):
+        for name, package in packages:
+            package.register('upstream', None, self.resolver(package))
+
+    def resolver(self, package):
+        return lambda upstream: self.resolve(package)
+
+    def resolve(self, package):
+        if package.name in self.emitted or package.upstream is None:
+            return
+        if not self.rawhide_loaded:
+            return
+        self.emitted.add(package.name)
+
+        rawhide = self.model.nvr_dict.get(package.name)
+        if rawhide and package.rawhide is None:
+            package.set_rawhide(rawhide)
+        version, release = rawhide or (None, None)
+        record = dict(
+            name=package.name,
+            owner=package.owner,
+            backend=package.backend,
+            rawhide_version=version,
+            rawhide_release=release,
+            upstream_version=package.upstream.get('version'),
+            anitya_id=package.upstream.get('id'),
+            status=package.status,
+        )
+        self.write(record)
+
+    def write(self, record):
+        if self.writer:
+            self.writer.writerow([
+                unicode(record[field] or '').encode('utf-8')
+                for field in fields
+            ])
+        else:
+            self.out.write(json.dumps(record) + '\n')
+        self.out.flush()
+
+    def finish_rawhide(self, result=None):
+        """ Write out everyone who was only waiting on repoquery. """
+        self.rawhide_loaded = True
+        for package in self.model.values():
+            self.resolve(package)
+
+    @twisted.internet.defer.inlineCallbacks
+    def run(self):
+        rawhide = self.model.build_nvr_dict()
+        rawhide.addCallback(self.finish_rawhide)
+        yield twisted.internet.defer.gatherResults(
+            [rawhide, self.model.load_pkgdb_packages()], consumeErrors=True)
+
+        # Anything still waiting on a signal, or which anitya never told us
+        # about.
+        for package in self.model.values():
+            self.resolve(package)
+            if package.name not in self.emitted:
+                self.emitted.add(package.name)
+                self.write(dict([(field, None) for field in fields],
+                                name=package.name, owner=package.owner,
+                                backend=package.backend))
+        self.model.flush()
+
+
+def command(config, fedmsg_config, argv):
+    """ `shipit report [--csv]`: write every package out and exit. """
+    format = 'csv' if '--csv' in argv else 'json'
+    model = shipit.model.assemble_model(config, fedmsg_config)
+    # Always ask anitya afresh; there is no bus to bring a snapshot or the
+    # store up to date.
+    model.snapshot, model.stored = {}, {}
+    reporter = Reporter(model, sys.stdout, format)
+
+    reactor = shipit.reactor.reactor
+    status = []
+
+    def done(result):
+        # Carrying on past a page we couldn't load leaves its packages out,
+        # so say so, as we would for anything else going wrong.
+        if model.load_failures:
+            status.append(1)
+            print('Could not load %i pages of packages from pkgdb' % len(
+                model.load_failures), file=sys.stderr)
+        if model.upstream_failures:
+            status.append(1)
+            print('Could not get %i packages from anitya' % len(
+                model.upstream_failures), file=sys.stderr)
+        shipit.utils.http.close()
+        reactor.stop()
+
+    def failed(failure):
+        status.append(1)
+        print(failure.getTraceback(), file=sys.stderr)
+        done(None)
+
+    def start():
+        reporter.run().addCallbacks(done, failed)
+
+    reactor.callWhenRunning(start)
+    reactor.run()
+    return status and status[0] or 0
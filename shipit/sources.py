@@ -0,0 +1,283 @@
+# This file is part of shipit, a curses-based, fedmsg-aware heads up display
+# for Fedora package maintainers.
+# Copyright (C) 2014  Ralph Bean <rbean@redhat.com>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import collections
+import errno
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+
+import twisted.internet.defer
+import twisted.internet.threads
+
+import shipit.utils
+from shipit.log import log
+from shipit.utils import run
+
+
+# "SHA512 (foo-1.0.tar.gz) = abcd..." and the older "abcd...  foo-1.0.tar.gz"
+sources_line = re.compile(r'^(\w+) \((.+)\) = ([0-9a-f]+)$')
+old_sources_line = re.compile(r'^([0-9a-f]{32})\s+(.+)$')
+
+
+def parse_sources_file(path):
+    """ Return a list of (filename, algorithm, hexdigest) from a dist-git
+    'sources' file.
+    """
+    entries = []
+    if not os.path.exists(path):
+        return entries
+
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            match = sources_line.match(line)
+            if match:
+                algo, filename, digest = match.groups()
+                entries.append((filename, algo.lower(), digest))
+                continue
+            match = old_sources_line.match(line)
+            if match:
+                digest, filename = match.groups()
+                entries.append((filename, 'md5', digest))
+    return entries
+
+
+def filename_for(url):
+    """ Where spectool would save a url to. """
+    if '#/' in url:
+        return url.split('#/', 1)[1]
+    return url.split('#')[0].rstrip('/').split('/')[-1]
+
+
+def link(source, dest):
+    """ Hard link source to dest, falling back to a copy across devices. """
+    if os.path.exists(dest):
+        os.unlink(dest)
+    try:
+        os.link(source, dest)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(source, dest)
+
+
+class SourceCache(object):
+    """ Content-addressed store of source tarballs shared across builds.
+
+    Lookaside files are stored under the checksum dist-git gives for them.
+    Upstream archives fetched by url are stored under their sha256 and
+    indexed by url plus the ETag or Last-Modified validator the server gave
+    us, so we only download them again when the server says they changed.
+    """
+
+    def __init__(self, config):
+        self.root = config['source_dir']
+        self.max_size = config['sources.max_size']
+        self.index_file = os.path.join(self.root, 'urls.json')
+        self.index = self.load_index()
+        self.stats = collections.Counter()
+        # Downloads in progress, by url, with the Deferreds waiting on them.
+        self.downloads = {}
+
+    def __repr__(self):
+        return "<SourceCache %r>" % self.root
+
+    def load_index(self):
+        if not os.path.exists(self.index_file):
+            return {}
+        try:
+            with open(self.index_file, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            return {}
+
+    def save_index(self):
+        with open(self.index_file, 'w') as f:
+            json.dump(self.index, f)
+
+    def path_for(self, algo, digest):
+        return os.path.join(self.root, 'objects', algo, digest)
+
+    def hit(self, path, dest):
+        self.stats['hits'] += 1
+        os.utime(path, None)
+        link(path, dest)
+
+    def add(self, source, algo, digest):
+        path = self.path_for(algo, digest)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        if not os.path.exists(path):
+            link(source, path)
+        return path
+
+    @twisted.internet.defer.inlineCallbacks
+    def fetch_lookaside(self, workdir):
+        """ Put every file from the lookaside 'sources' file into workdir.
+
+        'fedpkg sources' is only run if something is missing from the cache.
+        """
+        entries = parse_sources_file(os.path.join(workdir, 'sources'))
+        missing = [
+            entry for entry in entries
+            if not os.path.exists(self.path_for(entry[1], entry[2]))
+        ]
+
+        if missing:
+            self.stats['misses'] += len(missing)
+            yield run(['fedpkg', 'sources'], cwd=workdir)
+
+        downloaded = 0
+        for filename, algo, digest in entries:
+            dest = os.path.join(workdir, filename)
+            if (filename, algo, digest) in missing:
+                downloaded += os.path.getsize(dest)
+                self.add(dest, algo, digest)
+            else:
+                self.hit(self.path_for(algo, digest), dest)
+        self.stats['bytes'] += downloaded
+
+        yield self.evict()
+        yield self.log_stats()
+        yield twisted.internet.defer.returnValue(downloaded)
+
+    @twisted.internet.defer.inlineCallbacks
+    def fetch_url(self, url, workdir):
+        """ Put the file at url into workdir under the name spectool uses.
+
+        Fires with the number of bytes downloaded.
+        """
+        dest = os.path.join(workdir, filename_for(url))
+
+        resp = yield shipit.utils.http.head(url, allow_redirects=True)
+        validator = resp.headers.get('ETag') or \
+            resp.headers.get('Last-Modified')
+
+        while True:
+            cached = self.index.get(url)
+            if validator and cached and cached['validator'] == validator:
+                path = self.path_for('sha256', cached['sha256'])
+                if os.path.exists(path):
+                    self.hit(path, dest)
+                    yield twisted.internet.defer.returnValue(0)
+
+            # If another build is already downloading this, wait for it and
+            # take its copy, whether or not the server gave a validator.
+            # Should it fail, go round again and try ourselves.
+            if url not in self.downloads:
+                break
+            waiter = twisted.internet.defer.Deferred()
+            self.downloads[url].append(waiter)
+            digest = yield waiter
+            if digest:
+                path = self.path_for('sha256', digest)
+                if os.path.exists(path):
+                    self.hit(path, dest)
+                    yield twisted.internet.defer.returnValue(0)
+
+        self.stats['misses'] += 1
+        self.downloads[url] = []
+        digest = None
+        try:
+            resp = yield shipit.utils.http.get(url, stream=True)
+            resp.raise_for_status()
+            tmp, digest, size = yield twisted.internet.threads.deferToThread(
+                self._store, resp)
+            self.stats['bytes'] += size
+
+            path = self.add(tmp, 'sha256', digest)
+            os.unlink(tmp)
+            link(path, dest)
+
+            if validator:
+                self.index[url] = dict(validator=validator, sha256=digest)
+                self.save_index()
+        finally:
+            for waiter in self.downloads.pop(url):
+                waiter.callback(digest)
+
+        yield self.evict()
+        yield twisted.internet.defer.returnValue(size)
+
+    def _store(self, resp):
+        """ Stream a response to a temporary file.  Blocking. """
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='.download-')
+        sha256, size = hashlib.sha256(), 0
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in resp.iter_content(64 * 1024):
+                sha256.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        return tmp, sha256.hexdigest(), size
+
+    @twisted.internet.defer.inlineCallbacks
+    def fetch_urls(self, urls, workdir):
+        """ Fetch each of urls into workdir.  Fires with bytes downloaded.
+        """
+        downloaded = 0
+        for url in urls:
+            downloaded += yield self.fetch_url(url, workdir)
+
+        yield self.log_stats()
+        yield twisted.internet.defer.returnValue(downloaded)
+
+    @twisted.internet.defer.inlineCallbacks
+    def fetch_spec_sources(self, specfile, workdir):
+        """ Fetch every remote Source of a spec file, like 'spectool -g'. """
+        output = yield run(['spectool', '-l', '-a', specfile], cwd=workdir)
+        urls = []
+        for line in output.split('\n'):
+            if ':' not in line:
+                continue
+            tag, url = [part.strip() for part in line.split(':', 1)]
+            if '://' in url:
+                urls.append(url)
+
+        downloaded = yield self.fetch_urls(urls, workdir)
+        yield twisted.internet.defer.returnValue(downloaded)
+
+    def evict(self):
+        """ Remove least recently used objects until we fit in max_size. """
+        return twisted.internet.threads.deferToThread(self._evict)
+
+    def _evict(self):
+        objects = []
+        for root, dirs, files in os.walk(os.path.join(self.root, 'objects')):
+            for name in files:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                objects.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum([size for mtime, size, path in objects])
+        for mtime, size, path in sorted(objects):
+            if total <= self.max_size:
+                break
+            os.unlink(path)
+            total -= size
+
+    def log_stats(self):
+        return log('Source cache: %i hits, %i misses, %i bytes downloaded' % (
+            self.stats['hits'], self.stats['misses'], self.stats['bytes']))
@@ -0,0 +1,175 @@
+# This file is part of shipit, a curses-based, fedmsg-aware heads up display
+# for Fedora package maintainers.
+# Copyright (C) 2014  Ralph Bean <rbean@redhat.com>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import re
+import time
+
+
+tag_line = re.compile(r'^(\w+)(\s*):(\s*)(.*?)\s*$')
+define_line = re.compile(r'^%(?:global|define)\s+(\w+)\s+(.*?)\s*$')
+changelog_line = re.compile(r'^%changelog\s*$', re.IGNORECASE)
+macro = re.compile(r'%\{(\??)(\w+)\}|%(\w+)')
+
+# strftime is locale dependent and rpm wants these in English.
+days = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+          'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+def changelog_date(when=None):
+    when = time.gmtime(when)
+    return '%s %s %02i %i' % (
+        days[when.tm_wday], months[when.tm_mon - 1], when.tm_mday,
+        when.tm_year)
+
+
+class Spec(object):
+    """ An rpm spec file, read once and edited in place.
+
+    This only understands what we need to bump a package to a new upstream
+    version the way rpmdev-bumpspec --new does: the Version, Release,
+    Epoch, URL, Source and Patch tags, simple %global/%define macros and
+    %changelog.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.tags = {}
+        self.macros = {}
+        self.sources = []
+        self.changelog = None
+        self.parse()
+
+    def __repr__(self):
+        return "<Spec %s-%s>" % (self.version, self.release)
+
+    @classmethod
+    def read(cls, filename):
+        with open(filename, 'r') as f:
+            return cls(f.read().splitlines(True))
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            f.write(''.join(self.lines))
+
+    def parse(self):
+        self.tags, self.macros, self.sources = {}, {}, []
+        for i, line in enumerate(self.lines):
+            match = define_line.match(line)
+            if match:
+                self.macros[match.group(1)] = match.group(2)
+                continue
+
+            if changelog_line.match(line):
+                self.changelog = i
+                break
+
+            match = tag_line.match(line)
+            if not match:
+                continue
+            tag = match.group(1).lower()
+            if tag.startswith('source') or tag.startswith('patch'):
+                self.sources.append(match.group(4))
+            elif tag not in self.tags:
+                # Only the main package's preamble; ignore subpackages.
+                self.tags[tag] = i
+
+    def tag(self, name):
+        if name not in self.tags:
+            return None
+        return tag_line.match(self.lines[self.tags[name]]).group(4)
+
+    def set_tag(self, name, value):
+        i = self.tags[name]
+        match = tag_line.match(self.lines[i])
+        self.lines[i] = '%s%s:%s%s\n' % (
+            match.group(1), match.group(2), match.group(3), value)
+
+    @property
+    def version(self):
+        return self.tag('version')
+
+    @property
+    def release(self):
+        return self.tag('release')
+
+    def expand(self, text, depth=10):
+        """ Expand the macros we know about in text.
+
+        Conditional macros we don't know (like %{?dist}) expand to nothing.
+        Unconditional ones we don't know are left alone.
+        """
+        known = dict(self.macros)
+        for tag in ['name', 'version', 'release', 'epoch', 'url']:
+            if self.tag(tag) is not None:
+                known[tag] = self.tag(tag)
+        known['dist'] = ''
+
+        def replace(match):
+            conditional, braced, bare = match.groups()
+            name = braced or bare
+            if name in known:
+                return known[name]
+            if conditional:
+                return ''
+            return match.group(0)
+
+        for i in range(depth):
+            expanded = macro.sub(replace, text)
+            if expanded == text:
+                break
+            text = expanded
+        return text
+
+    def evr(self):
+        """ epoch:version-release, as written in a changelog entry. """
+        evr = '%s-%s' % (self.expand(self.version), self.expand(self.release))
+        if self.tag('epoch') is not None:
+            evr = '%s:%s' % (self.expand(self.tag('epoch')), evr)
+        return evr
+
+    def source_urls(self):
+        """ Expanded Source and Patch tags that point somewhere we can
+        download.
+
+        Ones still holding macros we couldn't expand are kept as they are,
+        since they may well be URLs; it's up to the caller to spot them.
+        """
+        return [
+            url for url in map(self.expand, self.sources)
+            if '://' in url or '%' in url
+        ]
+
+    def bump(self, version, comment, userstring, when=None):
+        """ Set a new version, reset the release and add a changelog entry.
+
+        This is what `rpmdev-bumpspec --new version -c comment -u userstring`
+        does.
+        """
+        release = re.sub(r'^[^%]*', '1', self.release)
+        self.set_tag('version', version)
+        self.set_tag('release', release)
+
+        entry = '* %s %s - %s\n- %s\n\n' % (
+            changelog_date(when), userstring, self.evr(), comment)
+        if self.changelog is None:
+            self.lines.append('\n%changelog\n')
+            self.changelog = len(self.lines) - 1
+        self.lines.insert(self.changelog + 1, entry)
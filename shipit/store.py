@@ -0,0 +1,124 @@
+# This file is part of shipit, a curses-based, fedmsg-aware heads up display
+# for Fedora package maintainers.
+# Copyright (C) 2014  Ralph Bean <rbean@redhat.com>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import json
+import os
+import sqlite3
+
+
+schema = """
+CREATE TABLE IF NOT EXISTS packages (
+    name TEXT PRIMARY KEY,
+    owner TEXT,
+    backend TEXT,
+    status TEXT,
+    rawhide TEXT,
+    upstream TEXT,
+    last_checked REAL,
+    pkgdb TEXT NOT NULL,
+    upstream_data TEXT
+);
+CREATE INDEX IF NOT EXISTS packages_owner ON packages (owner);
+CREATE INDEX IF NOT EXISTS packages_backend ON packages (backend);
+CREATE INDEX IF NOT EXISTS packages_status ON packages (status);
+CREATE INDEX IF NOT EXISTS packages_last_checked ON packages (last_checked);
+"""
+
+# Columns that may be queried on, which are also Package attributes.
+columns = ['name', 'owner', 'backend', 'status', 'last_checked']
+
+
+class Store(object):
+    """ Packages we watch, kept in SQLite so they can be queried by index.
+
+    This sits behind the PackageList, which stays the source of truth while
+    we run; it writes changed packages here in batches, and reads upstream
+    data back from here at startup.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        directory = os.path.dirname(self.filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.db = sqlite3.connect(self.filename)
+        self.db.executescript(schema)
+
+    def __repr__(self):
+        return "<Store %r>" % self.filename
+
+    def save(self, packages):
+        rows = []
+        for package in packages:
+            upstream = package.upstream or {}
+            rows.append((
+                package.name, package.owner, package.backend, package.status,
+                package.rawhide and package.rawhide[0],
+                upstream.get('version'), package.last_checked,
+                json.dumps(package.pkgdb),
+                package.upstream and json.dumps(package.upstream),
+            ))
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO packages (name, owner, backend, "
+                "status, rawhide, upstream, last_checked, pkgdb, "
+                "upstream_data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def load(self):
+        """ Upstream data and when it was last checked, by package name. """
+        return dict([
+            (name, (json.loads(upstream), last_checked))
+            for name, upstream, last_checked in self.db.execute(
+                "SELECT name, upstream_data, last_checked FROM packages "
+                "WHERE upstream_data IS NOT NULL")
+        ])
+
+    def prune(self, names):
+        """ Forget every package not in names. """
+        known = set([row[0] for row in
+                     self.db.execute("SELECT name FROM packages")])
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM packages WHERE name = ?",
+                [(name,) for name in known - set(names)])
+
+    def _where(self, where):
+        for column in where:
+            if column not in columns:
+                raise ValueError('Cannot query packages on %r' % column)
+        clauses = ['%s IS ?' % column for column in where]
+        if not clauses:
+            return '', ()
+        return ' WHERE ' + ' AND '.join(clauses), tuple(where.values())
+
+    def select(self, **where):
+        """ Names of packages whose columns equal the given values. """
+        clause, values = self._where(where)
+        return set([row[0] for row in self.db.execute(
+            "SELECT name FROM packages" + clause, values)])
+
+    def order(self, column, descending=False, **where):
+        """ Names of packages sorted by column, never-set values first. """
+        if column not in columns:
+            raise ValueError('Cannot sort packages on %r' % column)
+        clause, values = self._where(where)
+        return [row[0] for row in self.db.execute(
+            "SELECT name FROM packages%s ORDER BY %s %s, name" % (
+                clause, column, 'DESC' if descending else 'ASC'), values)]
@@ -19,6 +19,7 @@
 
 from __future__ import print_function
 
+import bisect
 import copy
 
 import urwid
@@ -38,28 +39,34 @@ class BaseRow(urwid.WidgetWrap):
         return True
 
 
-def pkgcols(a, b, c, d):
+def pkgcols(a, b, c, d, e, f):
     return urwid.Columns([
-        (40, urwid.Text(a)),
+        (30, urwid.Text(a)),
         (5, urwid.Text(b, align='center')),
         (13, urwid.Text(c, align='right')),
-        (32, urwid.Text(d, align='right')),
+        (20, urwid.Text(d, align='right')),
+        (20, urwid.Text(e, align='right')),
+        (16, urwid.Text(f, align='right')),
     ], dividechars=1)
 
 
 class PackageRow(BaseRow):
-    legend = pkgcols(u'package', u'match', u'upstream', u'rawhide')
+    legend = pkgcols(u'package', u'match', u'upstream', u'rawhide', u'build',
+                     u'backend')
 
     def __init__(self, package):
         self.package = package
         self.name = package.pkgdb['name']
         loading = '(loading...)'
         super(PackageRow, self).__init__(urwid.AttrMap(
-            pkgcols(self.name, u'', loading, loading), None, 'reversed'))
+            pkgcols(self.name, u'', loading, loading, u'',
+                    package.backend or u''), None, 'reversed'))
         if self.package.rawhide:
             self.set_rawhide(self.package.rawhide)
         if self.package.upstream:
             self.set_upstream(self.package.upstream)
+        if self.package.build:
+            self.set_build(self.package.build)
 
     def __repr__(self):
         return "<PackageRow %r>" % self.name
@@ -89,15 +96,31 @@ class PackageRow(BaseRow):
         column = 2  # Column number
         return self._w.original_widget.contents[column][0].get_text()[0]
 
+    def set_build(self, task):
+        return self.set_stage('%s %s' % (task.branch, task.state))
+
+    def set_stage(self, stage):
+        column = 4  # Column number
+        self._w.original_widget.contents[column][0].set_text(stage)
+        return shipit.utils.noop()
+
     def update_match(self):
-        rawhide, upstream = self.get_rawhide(), self.get_upstream()
-        if '(' in rawhide or '(' in upstream:
+        # -1 if rawhide is behind upstream, 1 if it is somehow ahead.
+        comparison = self.package.comparison
+        if comparison is None:
             self.set_match(u'?')
-        elif rawhide != upstream:
+        elif comparison < 0:
             self.set_match(u'✗')
+        elif comparison > 0:
+            self.set_match(u'>')
         else:
             self.set_match(u'✓')
 
+    def staleness(self):
+        """ Sort key putting outdated packages first and unknowns last. """
+        ranks = {-1: 0, 1: 1, 0: 2, None: 3}
+        return ranks[self.package.comparison], self.name
+
     def set_match(self, match):
         column = 1  # Column number
         self.match = match
@@ -129,19 +152,100 @@ class FilterableListBox(urwid.ListBox):
         self.commandbar = commandbar
         self.filters = {}
         self.reference = []
+        # Positions in originals of the items in reference, in order, so
+        # one item can be found or placed without looking at every other.
+        # A position is the item's sort key and when it was added, or just
+        # when it was added if we aren't sorted.
+        self.shown = []
+        self.sort_key = None
+        self.sort_name = None
+        # What cover set aside: our items, filters and sort.
+        self.covered = None
+        # Called with the listbox whenever the focus moves.
+        self.focus_callbacks = []
         self.set_originals([])
         super(FilterableListBox, self).__init__(self.reference)
 
+    def change_focus(self, *args, **kwargs):
+        result = super(FilterableListBox, self).change_focus(*args, **kwargs)
+        for callback in self.focus_callbacks:
+            callback(self)
+        return result
+
+    def set_focus(self, *args, **kwargs):
+        result = super(FilterableListBox, self).set_focus(*args, **kwargs)
+        for callback in self.focus_callbacks:
+            callback(self)
+        return result
+
     def __repr__(self):
         return "<FilterableListBox>"
 
     def initialized(self):
         return bool(self.originals)
 
+    def rank(self, item, arrival):
+        """ Where item goes in originals, given it was the arrival'th added.
+        """
+        if self.sort_key:
+            return self.sort_key(item), arrival
+        return arrival
+
     def set_originals(self, originals):
-        self.originals = copy.copy(originals)
+        self.unsorted = copy.copy(originals)
+        self.positions = dict([
+            (item, self.rank(item, i)) for i, item in enumerate(originals)
+        ])
+        self.originals = sorted(originals, key=self.positions.get)
+        self.ranks = [self.positions[item] for item in self.originals]
         self.filter_results()
 
+    def add_originals(self, items):
+        """ Add more items at the end, or in order if we are sorted.
+
+        While covered, they are kept for when we are uncovered.
+        """
+        if self.covered is not None:
+            self.covered[0].extend(items)
+            return
+        for item in items:
+            position = self.rank(item, len(self.unsorted))
+            self.positions[item] = position
+            self.unsorted.append(item)
+            i = bisect.bisect(self.ranks, position)
+            self.ranks.insert(i, position)
+            self.originals.insert(i, item)
+            if self.accepts(item):
+                i = bisect.bisect(self.shown, position)
+                self.shown.insert(i, position)
+                self.reference.insert(i, item)
+
+    def cover(self, items):
+        """ List items in place of ours, unfiltered and unsorted, until
+        uncover is called.
+        """
+        self.covered = (self.unsorted, self.filters, self.sort_key)
+        self.filters, self.sort_key = {}, None
+        self.clear()
+        self.set_originals(items)
+
+    def uncover(self):
+        """ Go back to listing our own items, and any added meanwhile. """
+        unsorted, self.filters, self.sort_key = self.covered
+        self.covered = None
+        self.clear()
+        self.set_originals(unsorted)
+
+    def set_sort(self, key, name=None):
+        """ Order rows by key, or as they came if key is None.
+
+        name says which sort this is, so toggles can tell theirs apart.
+        """
+        self.sort_key = key
+        self.sort_name = name if key else None
+        self.clear()
+        self.set_originals(self.unsorted)
+
     def add_filter(self, name, callback):
         self.filters[name] = callback
 
@@ -151,21 +255,36 @@ class FilterableListBox(urwid.ListBox):
     def clear(self):
         while self.reference:
             self.reference.pop()
+        self.shown = []
 
-    def filter_results(self):
-        # Add in all the originals on which *all* callbacks agree
-        for i, item in enumerate(self.originals):
-            if item in self.reference:
-                continue
-            if all([check(item) for check in self.filters.values()]):
-                self.reference.insert(i, item)
+    def accepts(self, item):
+        return all([check(item) for check in self.filters.values()])
 
-        # Remove any with which *at least one* callback disagrees
-        for item in list(self.reference):
-            if item not in self.reference:
-                continue
-            if any([not check(item) for check in self.filters.values()]):
-                self.reference.remove(item)
+    def filter_results(self):
+        # Keep all the originals on which *all* callbacks agree
+        self.reference[:] = [
+            item for item in self.originals if self.accepts(item)
+        ]
+        self.shown = [self.positions[item] for item in self.reference]
+
+    def refilter(self, item):
+        """ Show or hide one item whose data changed.
+
+        Items we aren't listing, like packages while the help is up, are
+        left alone.
+        """
+        if item not in self.positions:
+            return
+        position = self.positions[item]
+        shown = self.accepts(item)
+        i = bisect.bisect_left(self.shown, position)
+        present = i < len(self.shown) and self.shown[i] == position
+        if shown and not present:
+            self.reference.insert(i, item)
+            self.shown.insert(i, position)
+        elif present and not shown:
+            del self.reference[i]
+            del self.shown[i]
 
 
 class MainUI(urwid.Frame):
@@ -185,24 +304,34 @@ def assemble_ui(config, fedmsg_config, model):
     logbox = urwid.BoxAdapter(urwid.ListBox(shipit.log.logitems), logsize)
     logbox = urwid.LineBox(logbox, 'Logs')
 
+    summarybar = StatusBar('')
     filterbar = StatusBar('')
     commandbar = StatusBar('Initializing...')
-    footer = urwid.Pile([filterbar, commandbar])
+    footer = urwid.Pile([summarybar, filterbar, commandbar])
     listbox = FilterableListBox(commandbar=commandbar)
 
+    # Only the row whose status changed need be checked against the filters.
+    def refilter(row):
+        return lambda status: listbox.refilter(row)
+
     # Wire up some async update signals.  See shipit.signals.
     def initialize(packages):
         rows = [PackageRow(package) for name, package in packages]
-        listbox.set_originals(rows)
+        listbox.add_originals(rows)
         for row, name, package in zip(rows, *zip(*packages)):
             package.register('rawhide', None, row.set_rawhide)
             package.register('upstream', None, row.set_upstream)
+            package.register('build', None, row.set_build)
+            package.register('stage', None, row.set_stage)
+            package.register('status', None, refilter(row))
     model.register('pkgdb', None, initialize)
+    model.register('summary', None, summarybar.set_text)
 
     window = urwid.Frame(listbox, header=PackageRow.legend)
     main = MainUI(urwid.Frame(window, footer=logbox), footer=footer)
 
     # Hang these here for easy reference
+    main.summarybar = summarybar
     main.filterbar = filterbar
     main.commandbar = commandbar
     main.listbox = listbox
@@ -18,10 +18,15 @@
 
 from __future__ import print_function
 
+import collections
+import os
+import time
+import urlparse
 import webbrowser
 
 import twisted.internet.defer
-import twisted.internet.utils
+import twisted.internet.error
+import twisted.internet.protocol
 import txrequests
 import urwid
 
@@ -32,6 +37,7 @@ import shipit.utils
 
 # Global state
 http = None
+executor = None
 
 def noop():
     """ Returns a no-op twisted deferred. """
@@ -45,6 +51,192 @@ def initialize_http(config, fedmsg_config):
     http = txrequests.Session(maxthreads=config['http.threads'])
 
 
+def initialize_executor(config, fedmsg_config):
+    global executor
+    executor = Executor(config)
+
+
+def percentile(values, fraction):
+    """ The value below which `fraction` of the values fall. """
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class TokenBucket(object):
+    """ Hands out `rate` tokens a second, saving up at most `burst`. """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.time()
+        self.waiting = collections.deque()
+        self.timer = None
+
+    def take(self):
+        """ Returns a Deferred that fires once a token is ours. """
+        d = twisted.internet.defer.Deferred()
+        self.waiting.append(d)
+        self.drain()
+        return d
+
+    def drain(self):
+        now = time.time()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        while self.waiting and self.tokens >= 1:
+            self.tokens -= 1
+            self.waiting.popleft().callback(None)
+
+        if self.waiting and self.timer is None:
+            delay = (1 - self.tokens) / self.rate
+            self.timer = shipit.reactor.reactor.callLater(delay, self.wake)
+
+    def wake(self):
+        self.timer = None
+        self.drain()
+
+
+class HostThrottle(object):
+    """ A TokenBucket for every host we talk to. """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+
+    def wait(self, url):
+        """ Returns a Deferred that fires when we may request url. """
+        host = urlparse.urlparse(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.burst)
+        return self.buckets[host].take()
+
+
+class _Collector(twisted.internet.protocol.ProcessProtocol):
+    """ Gather a child's output and fire with (out, err, code). """
+    def __init__(self, deferred):
+        self.deferred = deferred
+        self.out, self.err = [], []
+
+    def outReceived(self, data):
+        self.out.append(data)
+
+    def errReceived(self, data):
+        self.err.append(data)
+
+    def processEnded(self, reason):
+        code = reason.value.exitCode
+        if code is None:
+            # Killed by a signal
+            code = -(reason.value.signal or 1)
+        self.deferred.callback((''.join(self.out), ''.join(self.err), code))
+
+
+class Executor(object):
+    """ Runs child processes with limits on how many of each run at once.
+
+    Commands are classed by the name of their executable.  Each class gets
+    its own cap from process.limits, with 'default' for the rest.  Children
+    running longer than process.timeout get SIGTERM, then SIGKILL
+    process.kill_grace seconds later.  How long each class of command takes
+    and how often it fails is kept for the debug view.
+    """
+
+    def __init__(self, config):
+        self.limits = config['process.limits']
+        self.timeout = config['process.timeout']
+        self.grace = config['process.kill_grace']
+        self.semaphores = {}
+        # Deferreds of commands still waiting for a slot.
+        self.pending = set()
+        self.durations = collections.defaultdict(
+            lambda: collections.deque(maxlen=500))
+        self.counts = collections.Counter()
+        self.failures = collections.Counter()
+
+    def semaphore_for(self, kind):
+        if kind not in self.semaphores:
+            limit = self.limits.get(kind, self.limits['default'])
+            self.semaphores[kind] = twisted.internet.defer.DeferredSemaphore(
+                limit)
+        return self.semaphores[kind]
+
+    @twisted.internet.defer.inlineCallbacks
+    def execute(self, cmd, cwd=None):
+        """ Run cmd, once there is a slot for it.
+
+        Fires with (out, err, code).  Fails with CancelledError if
+        cancel_pending is called while the command is still waiting.
+        """
+        kind = os.path.basename(cmd[0])
+        semaphore = self.semaphore_for(kind)
+
+        waiting = semaphore.acquire()
+        self.pending.add(waiting)
+        try:
+            yield waiting
+        finally:
+            self.pending.discard(waiting)
+
+        start = time.time()
+        try:
+            finished = twisted.internet.defer.Deferred()
+            process = shipit.reactor.reactor.spawnProcess(
+                _Collector(finished), cmd[0], cmd, env=os.environ, path=cwd)
+
+            timers = [
+                shipit.reactor.reactor.callLater(
+                    self.timeout, self.signal, process, 'TERM'),
+                shipit.reactor.reactor.callLater(
+                    self.timeout + self.grace, self.signal, process, 'KILL'),
+            ]
+            try:
+                out, err, code = yield finished
+            finally:
+                for timer in timers:
+                    if timer.active():
+                        timer.cancel()
+        finally:
+            semaphore.release()
+
+        self.counts[kind] += 1
+        self.durations[kind].append(time.time() - start)
+        if code != 0:
+            self.failures[kind] += 1
+
+        yield twisted.internet.defer.returnValue((out, err, code))
+
+    def signal(self, process, signal):
+        shipit.log.log('Timed out, sending SIG%s to %r' % (
+            signal, process.pid))
+        try:
+            process.signalProcess(signal)
+        except twisted.internet.error.ProcessExitedAlready:
+            pass
+
+    def cancel_pending(self):
+        """ Cancel every command that hasn't started yet. """
+        pending = list(self.pending)
+        for deferred in pending:
+            deferred.cancel()
+        return len(pending)
+
+    def summary(self):
+        """ One line of statistics per class of command. """
+        return [
+            '%s: %i runs, %i failed, p50 %.1fs, p95 %.1fs' % (
+                kind, self.counts[kind], self.failures[kind],
+                percentile(self.durations[kind], 0.5),
+                percentile(self.durations[kind], 0.95))
+            for kind in sorted(self.counts)
+        ]
+
+
 def vimify():
     """ Add vim keys to urwid """
     vim_keys = {
@@ -72,14 +264,13 @@ def patch_webbrowser():
 def run(cmd, cwd=None):
     yield shipit.log.log('(%s)$ %s' % (cwd, ' '.join(cmd)))
 
-    out, err, code = yield twisted.internet.utils.getProcessOutputAndValue(
-        cmd[0], args=cmd[1:], path=cwd)
+    out, err, code = yield executor.execute(cmd, cwd=cwd)
 
     if err:
         yield shipit.log.log("stderr: %r" % err)
 
     if code != 0:
         yield shipit.log.log('ERROR:  return code %r' % code)
-        raise Exception
+        raise Exception('%s exited with %r' % (cmd[0], code))
 
     yield twisted.internet.defer.returnValue(out)
@@ -0,0 +1,122 @@
+# This file is part of shipit, a curses-based, fedmsg-aware heads up display
+# for Fedora package maintainers.
+# Copyright (C) 2014  Ralph Bean <rbean@redhat.com>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import functools
+import re
+
+
+segment = re.compile(r'~|\^|[0-9]+|[a-zA-Z]+')
+
+# 1.0rc1, 1.0-beta.2, 1.0.0a1 and friends sort before 1.0, which in an rpm
+# version means putting a tilde in front of them.
+prerelease = re.compile(
+    r'(?<=\d)[._~-]?(alpha|beta|pre|rc|dev|a(?=\d)|b(?=\d))',
+    re.IGNORECASE)
+
+# Parsed versions, by the string they came from.
+_parsed = {}
+
+
+def parse(version):
+    """ Split a version into the segments rpmvercmp compares.
+
+    Separators are dropped.  Numbers become ints and letters stay strings,
+    with '~' and '^' kept as markers.
+    """
+    if version not in _parsed:
+        _parsed[version] = [
+            int(part) if part.isdigit() else part
+            for part in segment.findall(version)
+        ]
+    return _parsed[version]
+
+
+def _cmp(a, b):
+    return (a > b) - (a < b)
+
+
+def rpmvercmp(a, b):
+    """ Compare two versions like rpm does.  Returns -1, 0 or 1.
+
+    Tilde sorts before anything, even the end of the version, so 1.0~rc1
+    is older than 1.0.  Caret sorts after the end of the version but before
+    anything else, so 1.0^git1 is newer than 1.0 but older than 1.0.1.
+    """
+    if a == b:
+        return 0
+
+    one, two = parse(a), parse(b)
+    for i in range(max(len(one), len(two))):
+        x = one[i] if i < len(one) else None
+        y = two[i] if i < len(two) else None
+
+        if x == '~' or y == '~':
+            if x != '~':
+                return 1
+            if y != '~':
+                return -1
+            continue
+
+        if x == '^' or y == '^':
+            if x is None:
+                return -1
+            if y is None:
+                return 1
+            if x != '^':
+                return 1
+            if y != '^':
+                return -1
+            continue
+
+        # Whichever has segments left over is newer.
+        if x is None:
+            return -1
+        if y is None:
+            return 1
+
+        # Numeric segments are newer than alphabetic ones.
+        if isinstance(x, int) != isinstance(y, int):
+            return 1 if isinstance(x, int) else -1
+
+        if x != y:
+            return _cmp(x, y)
+
+    return 0
+
+
+key = functools.cmp_to_key(rpmvercmp)
+
+
+def normalize(version):
+    """ Make an upstream version compare the way Fedora would package it.
+
+    A leading 'v' is dropped and prereleases get a tilde, so 'v1.0rc1'
+    becomes '1.0~rc1'.
+    """
+    version = version.strip()
+    if version[:1] in 'vV' and version[1:2].isdigit():
+        version = version[1:]
+    return prerelease.sub(lambda match: '~' + match.group(1), version, 1)
+
+
+def compare(rawhide, upstream):
+    """ Is rawhide older (-1), the same as (0) or newer (1) than upstream?
+    """
+    return rpmvercmp(normalize(rawhide), normalize(upstream))
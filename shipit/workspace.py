@@ -0,0 +1,189 @@
+# This file is part of shipit, a curses-based, fedmsg-aware heads up display
+# for Fedora package maintainers.
+# Copyright (C) 2014  Ralph Bean <rbean@redhat.com>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import collections
+import errno
+import os
+import shutil
+import tempfile
+import time
+
+import twisted.internet.defer
+import twisted.internet.task
+import twisted.internet.threads
+
+import shipit.mirror
+from shipit.log import log
+
+
+prefix = 'shipit-'
+# Inside each workspace, holding the pid of the shipit that made it.
+owner_file = '.shipit-owner'
+
+
+def empty(path):
+    """ Remove everything inside path but its owner file, or create it.
+    Blocking.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+        return
+    for name in os.listdir(path):
+        if name == owner_file:
+            continue
+        child = os.path.join(path, name)
+        if os.path.isdir(child) and not os.path.islink(child):
+            shutil.rmtree(child, ignore_errors=True)
+        else:
+            os.unlink(child)
+
+
+def owned(path):
+    """ Mark path as belonging to this process.  Blocking. """
+    with open(os.path.join(path, owner_file), 'w') as f:
+        f.write('%i\n' % os.getpid())
+
+
+def abandoned(path):
+    """ Whether path is ours to remove: made by this user, by a process
+    that has since gone away.  Blocking.
+    """
+    if os.stat(path).st_uid != os.getuid():
+        return False
+    try:
+        with open(os.path.join(path, owner_file), 'r') as f:
+            pid = int(f.read().strip())
+    except (IOError, ValueError):
+        # Not one of ours, or its owner died before marking it.
+        return None
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.ESRCH
+    return False
+
+
+class WorkspacePool(object):
+    """ Build directories under workspace_dir, handed out and reused.
+
+    Point workspace_dir at a tmpfs to keep build I/O off the disk.  At most
+    workspace.max are in use at once; anyone else waits.  Released
+    directories are emptied and handed out again.  A reaper removes
+    directories this user's earlier sessions left behind, once the session
+    that made one has exited; unmarked ones only once they are older than
+    workspace.stale seconds.  Other users' directories are never touched.
+    """
+
+    def __init__(self, config):
+        self.root = config['workspace_dir']
+        self.stale = config['workspace.stale']
+        self.semaphore = twisted.internet.defer.DeferredSemaphore(
+            config['workspace.max'])
+        self.free = []
+        self.busy = set()
+        self.waits = collections.deque(maxlen=100)
+        self.reaper = twisted.internet.task.LoopingCall(self.reap)
+
+    def __repr__(self):
+        return "<WorkspacePool %r>" % self.root
+
+    @twisted.internet.defer.inlineCallbacks
+    def acquire(self):
+        """ Fires with the path of an empty directory, once one is free. """
+        start = time.time()
+        yield self.semaphore.acquire()
+        wait = time.time() - start
+        self.waits.append(wait)
+        if wait > 1:
+            yield log('Waited %is for a workspace' % wait)
+
+        if self.free:
+            path = self.free.pop()
+        else:
+            if not os.path.isdir(self.root):
+                os.makedirs(self.root)
+            path = tempfile.mkdtemp(prefix=prefix, dir=self.root)
+            owned(path)
+        self.busy.add(path)
+        yield twisted.internet.defer.returnValue(path)
+
+    @twisted.internet.defer.inlineCallbacks
+    def release(self, path):
+        """ Empty a workspace and put it back for someone else. """
+        try:
+            yield twisted.internet.threads.deferToThread(empty, path)
+            # In case something removed the workspace itself.
+            yield twisted.internet.threads.deferToThread(owned, path)
+            self.free.append(path)
+        except Exception as e:
+            yield log('Could not clean workspace %r: %r' % (path, e))
+        finally:
+            self.busy.discard(path)
+            self.semaphore.release()
+
+    def start_reaper(self, interval=600):
+        self.reaper.start(interval, now=True)
+
+    @twisted.internet.defer.inlineCallbacks
+    def reap(self):
+        """ Remove workspaces left behind by sessions that have exited.
+
+        Errors are only logged, so that the reaper keeps running.
+        """
+        if not os.path.isdir(self.root):
+            return
+
+        cutoff = time.time() - self.stale
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not name.startswith(prefix) or not os.path.isdir(path):
+                continue
+            if path in self.busy or path in self.free:
+                continue
+            try:
+                dead = yield twisted.internet.threads.deferToThread(
+                    abandoned, path)
+                if dead is None:
+                    dead = os.path.getmtime(path) < cutoff
+                if not dead:
+                    continue
+                yield log('Reaping abandoned workspace %r' % path)
+                yield twisted.internet.threads.deferToThread(
+                    shutil.rmtree, path, True)
+            except Exception as e:
+                yield log('Could not reap workspace %r: %r' % (path, e))
+
+    @twisted.internet.defer.inlineCallbacks
+    def report(self):
+        """ Log disk usage and how long builds have waited for a workspace.
+        """
+        used = 0
+        for path in self.busy:
+            used += yield twisted.internet.threads.deferToThread(
+                shipit.mirror.disk_usage, path)
+
+        stat = os.statvfs(self.root)
+        available = stat.f_bavail * stat.f_frsize
+        average = sum(self.waits) / max(len(self.waits), 1)
+
+        yield log('Workspaces in %s: %i busy, %i free, %i MiB used, '
+                  '%i MiB available, %.1fs average wait' % (
+                      self.root, len(self.busy), len(self.free),
+                      used / 1024 ** 2, available / 1024 ** 2, average))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# This file is part of shipit, a curses-based, fedmsg-aware heads up display
+# for Fedora package maintainers.
+# Copyright (C) 2014  Ralph Bean <rbean@redhat.com>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+""" Compare shipit.spec's bump with rpmdev-bumpspec, byte for byte.
+
+Each NAME.spec here is bumped to the version listed in `cases` and the
+result compared with NAME.spec.expected.  Run with --regenerate on a box
+with rpmdevtools to rewrite the expected files from rpmdev-bumpspec itself.
+The new changelog entry is always dated `when`, since rpmdev-bumpspec can
+only use today's date.
+"""
+
+from __future__ import print_function
+
+import calendar
+import difflib
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', '..'))
+
+import shipit.spec
+
+cases = {
+    'simple.spec': '1.5.0',
+    'epoch.spec': '1.0',
+}
+userstring = 'Jane Packager <jane@example.com>'
+when = calendar.timegm((2026, 1, 15, 12, 0, 0))
+first_date = re.compile(r'^(\* )\w{3} \w{3} \d{2} \d{4}', re.MULTILINE)
+
+
+def comment(version):
+    return 'Latest upstream, %s' % version
+
+
+def bump(filename, version):
+    spec = shipit.spec.Spec.read(os.path.join(here, filename))
+    spec.bump(version, comment(version), userstring, when)
+    return ''.join(spec.lines)
+
+
+def bumpspec(filename, version):
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, filename)
+        shutil.copy(os.path.join(here, filename), path)
+        subprocess.check_call([
+            'rpmdev-bumpspec', '--new', version, '-c', comment(version),
+            '-u', userstring, path])
+        with open(path, 'r') as f:
+            text = f.read()
+    finally:
+        shutil.rmtree(tmp)
+    date = shipit.spec.changelog_date(when)
+    return first_date.sub(lambda match: match.group(1) + date, text, 1)
+
+
+def main(argv):
+    failed = 0
+    for filename, version in sorted(cases.items()):
+        expected_file = os.path.join(here, filename + '.expected')
+        if '--regenerate' in argv:
+            with open(expected_file, 'w') as f:
+                f.write(bumpspec(filename, version))
+            print('Wrote', expected_file)
+            continue
+
+        with open(expected_file, 'r') as f:
+            expected = f.read()
+        actual = bump(filename, version)
+        if actual == expected:
+            print('ok', filename)
+            continue
+        failed += 1
+        print('FAILED', filename)
+        sys.stdout.writelines(difflib.unified_diff(
+            expected.splitlines(True), actual.splitlines(True),
+            'rpmdev-bumpspec', 'shipit'))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,19 @@
+%global srcname bar
+
+Name:		%{srcname}
+Epoch:		2
+Version:	0.9
+Release:	12%{?dist}
+Summary:	Bars, mostly
+
+License:	GPL-2.0-or-later
+URL:		https://bar.example.org
+Source0:	https://bar.example.org/releases/%{srcname}-%{version}.tar.xz
+Patch0:		bar-0.9-fix-build.patch
+
+%description
+Bars, mostly.
+
+%changelog
+* Tue Jun 04 2024 Jane Packager <jane@example.com> - 2:0.9-12
+- Fix the build
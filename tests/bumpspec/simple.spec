@@ -0,0 +1,26 @@
+Name:           python-foo
+Version:        1.4.2
+Release:        3%{?dist}
+Summary:        Does foo things
+
+License:        MIT
+URL:            https://example.com/foo
+Source0:        %{url}/archive/%{version}/foo-%{version}.tar.gz
+
+BuildArch:      noarch
+
+%description
+Does foo things.
+
+%prep
+%autosetup -n foo-%{version}
+
+%files
+%license LICENSE
+
+%changelog
+* Mon Mar 02 2025 Jane Packager <jane@example.com> - 1.4.2-3
+- Rebuilt
+
+* Fri Jan 10 2025 Jane Packager <jane@example.com> - 1.4.2-1
+- Latest upstream